@@ -0,0 +1,71 @@
+'''
+Merge origins with nearly identical distances to every destination into weighted super-origins
+
+origins whose distances all fall in the same bins of width tolerance are merged. a super-origin
+has the summed population and the population weighted mean of its members' distances, so no member
+is more than error[o] < tolerance away from it to any destination. for any facility set an
+origin's nearest open distance then moves by at most error[o], which bounds the objectives:
+- p median (population weighted total distance): sum_o populations[o]*error[o]
+- kolm pollak EDE (and the mean or max distance): max_o error[o]
+and an optimum of the aggregated problem is within twice these of the true optimum
+'''
+
+# import libraries
+import numpy as np
+from scipy import sparse
+import build
+import logging
+logging.basicConfig(
+    format='%(asctime)s %(levelname)-8s %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def aggregate(location, tolerance):
+    '''
+    returns the location with merged origins (each named after its first member, with the members
+    in location['members']) and the error report. distances must be untransformed, and every one known
+    '''
+    origins, destinations = location['origins'], location['destinations']
+    if sparse.issparse(location['distances']):
+        logger.warning('aggregate: some distances are missing, not aggregating')
+        return location, None
+    arrays = build.location_arrays(origins, destinations, location['populations'], location['distances'],
+                                   location['existing'])
+    cost, population = arrays['cost'], arrays['populations']
+
+    # origins with the same binned distances to every destination form a group
+    _, group = np.unique(np.floor(cost/tolerance), axis=0, return_inverse=True)
+    group = group.ravel()
+    n_groups = group.max() + 1
+    group_population = np.bincount(group, weights=population, minlength=n_groups)
+    # population weighted mean distances of each group (plain mean for unpopulated groups)
+    weights = np.where(group_population[group] > 0, population, 1.0)
+    total = np.zeros((n_groups, cost.shape[1]))
+    np.add.at(total, group, weights[:, None]*cost)
+    group_cost = total/np.bincount(group, weights=weights, minlength=n_groups)[:, None]
+    # worst distance error of every origin
+    error = np.abs(cost - group_cost[group]).max(axis=1)
+
+    # name each group after its first member
+    first = np.full(n_groups, len(origins))
+    np.minimum.at(first, group, np.arange(len(origins)))
+    names = [origins[i] for i in first]
+    members = {name: [] for name in names}
+    for o, g in zip(origins, group):
+        members[names[g]].append(o)
+
+    report = {'origins': len(origins), 'super_origins': int(n_groups), 'max_error': float(error.max()),
+              'pmedian_error': float(population @ error), 'ede_error': float(error.max())}
+    logger.info('aggregated {} origins into {}: distances off by at most {:.4g}, p median objective by {:.4g}'.format(
+        report['origins'], report['super_origins'], report['max_error'], report['pmedian_error']))
+
+    aggregated = dict(location)
+    aggregated['origins'] = names
+    aggregated['populations'] = group_population
+    aggregated['distances'] = group_cost.astype(np.float32)
+    aggregated['origin_index'] = {name: i for i, name in enumerate(names)}
+    aggregated['members'] = members
+    aggregated['aggregation'] = report
+    return aggregated, report
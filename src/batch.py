@@ -0,0 +1,174 @@
+'''
+Run many configs in parallel on one machine, instead of editing config_filename in main.py
+
+    python src/batch.py 'config/*.yml' --jobs 8 --memory 16 --timeout 3600 --results batch.csv
+
+takes config files and/or glob patterns (from the repository root, like main.py), runs each in its
+own process, at most jobs at a time, each within the memory cap (GB of address space) and timeout
+(seconds). every run goes into one results table (see main.record): runs that time out, run out
+of memory or fail get a row with that status and no facilities
+'''
+
+# import libraries
+import os
+import sys
+import glob
+import time
+import yaml
+import argparse
+import resource
+import multiprocessing
+from queue import Empty
+import main
+import solvers
+import logging
+logging.basicConfig(
+    format='%(asctime)s %(levelname)-8s %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def config_paths(patterns):
+    '''
+    the config files matching the patterns, in order and without duplicates, skipping the
+    solver profiles and any yml that is not a run config (see load_config)
+    '''
+    paths = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            if os.path.basename(path) != 'solver_profiles.yml' and path not in paths and load_config(path) is not None:
+                paths.append(path)
+    return paths
+
+
+def load_config(path):
+    '''
+    the run config at path, None (with a warning) if it cannot be read or has no location or optimize,
+    e.g. the query configs in config/
+    '''
+    try:
+        with open(path) as file:
+            config = yaml.safe_load(file)
+    except (OSError, yaml.YAMLError) as error:
+        logger.warning('batch: skipping {}: {}'.format(path, error))
+        return None
+    if not isinstance(config, dict) or 'location' not in config or 'optimize' not in config:
+        logger.warning('batch: skipping {}, not a run config (no location or optimize)'.format(path))
+        return None
+    return config
+
+
+def batch(paths, jobs=None, memory=None, timeout=None, results='computation_time.csv'):
+    '''
+    run the configs at paths in up to jobs processes (default: one per core), each limited to memory GB
+    and timeout seconds, recording every run in results. returns the results (see solvers.result) by path
+    '''
+    jobs = jobs or multiprocessing.cpu_count()
+    configs = {}
+    for path in paths:
+        config = load_config(path)
+        if config is not None:
+            configs[path] = dict(config, results=results)
+    paths = [path for path in paths if path in configs]
+    logger.info('batch: {} configs, {} at a time'.format(len(paths), jobs))
+
+    queue = multiprocessing.Queue()
+    waiting, running, finished = list(paths), {}, {}
+    while waiting or running:
+        # start jobs while there is room
+        while waiting and len(running) < jobs:
+            path = waiting.pop(0)
+            process = multiprocessing.Process(target=run, args=(path, configs[path], memory, queue))
+            process.start()
+            running[path] = (process, time.time())
+            logger.info('batch: started {}'.format(path))
+
+        try:
+            path, result, elapsed = queue.get(timeout=1)
+        except Empty:
+            path = None
+        # (a job stopped for its timeout may still have reported)
+        if path in running:
+            running.pop(path)[0].join()
+            finished[path] = result
+            record(path, configs[path], elapsed, result)
+            logger.info('batch: {} {} in {:.1f}s ({} left)'.format(
+                path, status(result), elapsed, len(waiting) + len(running)))
+
+        # stop the jobs over time, and note those that died without reporting (e.g. killed for memory)
+        for path, (process, begin) in list(running.items()):
+            if timeout is not None and time.time() - begin > timeout:
+                process.terminate()
+                reason = 'timeout'
+            elif not process.is_alive() and queue.empty():
+                reason = 'failed (exit code {})'.format(process.exitcode)
+            else:
+                continue
+            process.join()
+            running.pop(path)
+            finished[path] = solvers.result([], [], status=reason)
+            record(path, configs[path], time.time() - begin, finished[path])
+            logger.warning('batch: {} {}'.format(path, reason))
+    return finished
+
+
+def run(path, config, memory, queue):
+    '''
+    one job of batch: runs the config (see main.main) and reports its result on the queue
+    '''
+    # a soft limit, lifted again to report (the queue needs a thread, which needs memory)
+    hard = resource.getrlimit(resource.RLIMIT_AS)[1]
+    if memory is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (int(memory*2**30), hard))
+    begin = time.time()
+    try:
+        result = main.main(config)
+    except MemoryError:
+        result = solvers.result([], [], status='memory')
+    except Exception as error:
+        # SCIP reports running out of memory as an error
+        logger.warning('batch: {} failed: {}'.format(path, error))
+        result = solvers.result([], [], status='memory' if 'memory' in str(error).lower() else 'failed')
+    resource.setrlimit(resource.RLIMIT_AS, (hard, hard))
+    queue.put((path, result, time.time() - begin))
+
+
+def record(path, config, elapsed, result):
+    '''
+    a finished job in the results table, named after its path if the config has no location.
+    sweeps and frontiers record their own solves as they go. never raises, so one bad config
+    cannot stop the batch
+    '''
+    if ('sweep' in config or 'frontier' in config) and status(result) == 'done':
+        return
+    config = dict(config, location=config.get('location', path), optimize=config.get('optimize'))
+    if config['location'] == 'grid' and 'grid_size' not in config:
+        config['location'] = path
+    try:
+        main.record(config, config.get('num_to_open'), elapsed, result)
+    except Exception as error:
+        logger.error('batch: could not record {}: {}'.format(path, error))
+
+
+def status(result):
+    '''
+    the status of a job's result, done for the results of sweeps and frontiers
+    '''
+    if isinstance(result, dict) and 'status' in result:
+        return result['status']
+    return 'done'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run config files in parallel')
+    parser.add_argument('configs', nargs='+', help='config files or glob patterns, e.g. config/*.yml')
+    parser.add_argument('--jobs', type=int, default=None, help='parallel runs (default: one per core)')
+    parser.add_argument('--memory', type=float, default=None, help='memory cap per run, in GB')
+    parser.add_argument('--timeout', type=float, default=None, help='time limit per run, in seconds')
+    parser.add_argument('--results', default='computation_time.csv', help='results table')
+    args = parser.parse_args()
+    paths = config_paths(args.configs)
+    if not paths:
+        sys.exit('no configs match {}'.format(' '.join(args.configs)))
+    batch(paths, args.jobs, args.memory, args.timeout, args.results)
@@ -0,0 +1,206 @@
+'''
+Benders decomposition of the population weighted assignment objective shared by
+p median and kolm pollak exact linearisation (where distances are already e^(alpha*d[o,d]))
+
+the master problem only holds the siting decisions x_d and one theta_b per block of origins.
+given x, an origin's assignment subproblem is solved analytically: if the first distance level
+at which x opens a total of one facility is c*_o, then for every x
+    theta_o >= c*_o - sum_d max(0, c*_o - distances[o,d])*x_d
+(the dual of the radius formulation, valid for fractional x as well). the cuts of a block's
+origins are summed, so every cut has at most one coefficient per destination and the master
+grows with the number of candidates and cuts rather than with origins x destinations.
+cuts are separated lazily by a SCIP constraint handler for LP and integer solutions. with sparse pairs
+the master also has a cover row per distinct set of kept destinations (see add_cover)
+'''
+
+# import libraries
+try:
+    from pyscipopt import Conshdlr, SCIP_RESULT, quicksum
+except ImportError:
+    # benders needs SCIP, this only lets main import without pyscipopt (for the highs backend)
+    Conshdlr = object
+import numpy as np
+import build
+import heuristic
+import solvers
+import time
+import logging
+logging.basicConfig(
+    format='%(asctime)s %(levelname)-8s %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def benders(origins, destinations, populations, distances, open_total, open_current, pairs=None, blocks=32, profile=None,
+            anytime=False):
+    '''
+    returns the result (see solvers.result) with the number of cuts added. anytime as in optimize.solve
+    '''
+    begin = time.time()
+    arrays = build.location_arrays(origins, destinations, populations, distances, open_current, pairs)
+    od = build.pair_arrays(arrays['cost'], arrays['open'])
+    model = solvers.apply_profile(master_model(arrays, od, open_total, blocks), profile)
+
+    # start from the heuristic's facility set: an incumbent and a first round of cuts
+    x_start = heuristic.interchange(od, arrays['populations'],
+                                    heuristic.greedy(od, arrays['populations'], arrays['open'], open_total),
+                                    arrays['open'])
+    model.data['benders'].add_start(x_start)
+    if anytime:
+        solvers.anytime(model, anytime if callable(anytime) else None)
+    build_time = time.time() - begin
+
+    logger.info('optimizing')
+    begin = time.time()
+    model.optimize()
+    logger.info('optimization complete')
+    result = solvers.scip_result(model, build_time, time.time() - begin)
+    result['cuts'] = model.data['benders'].n_cuts
+    logger.info('benders: lower bound {:.6g}, upper bound {:.6g}, gap {:.4%}, {} cuts'.format(
+        result['bound'], result['objective'], result['gap'], result['cuts']))
+    return result
+
+
+def master_model(arrays, od, open_total, blocks):
+    '''
+    facility model with a theta per block of origins and the constraint handler generating the cuts
+    '''
+    program = build.facility_program(arrays, open_total)
+    add_cover(program, od)
+    model = solvers.scip_model(program)
+    n_origins = len(od['indptr']) - 1
+    blocks = min(blocks, n_origins)
+    block = np.arange(n_origins)*blocks//n_origins
+    weighted_min = arrays['populations']*np.minimum.reduceat(od['cost'], od['indptr'][:-1])
+    # theta_b is at least the cost of every origin in the block at its nearest destination
+    theta = [model.addVar(vtype="C", lb=lb, obj=1, name="theta(%s)" % (b))
+             for b, lb in enumerate(np.bincount(block, weights=weighted_min, minlength=blocks).tolist())]
+
+    handler = BendersCuts(od, arrays['populations'], block, model.data['x'], theta)
+    model.includeConshdlr(handler, "assignmentcuts", "benders optimality cuts for the assignment subproblems",
+                          sepapriority=1000, enfopriority=-1, chckpriority=-1, sepafreq=1, needscons=False)
+    # theta is only bounded below through the lazy cuts, so presolve must not fix it at its bound
+    model.setBoolParam("misc/allowstrongdualreds", False)
+    model.setBoolParam("misc/allowweakdualreds", False)
+    model.data['theta'], model.data['benders'] = theta, handler
+    return model
+
+
+def add_cover(program, od):
+    '''
+    sum_{d in pairs(o)} x_d >= 1 for every distinct set of kept destinations without an open one, so the
+    master cannot open a facility set leaving an origin with nowhere to go (the cuts charge such an
+    origin its furthest kept destination as if it were open)
+    '''
+    sets = set()
+    for i in range(len(od['indptr']) - 1):
+        cols = od['cols'][od['indptr'][i]:od['indptr'][i + 1]]
+        if not program['open'][cols].any():
+            sets.add(tuple(np.sort(cols).tolist()))
+    if len(sets) == 0:
+        return
+    sets = [np.array(cols, dtype=int) for cols in sets]
+    build.add_rows(program, np.repeat(np.arange(len(sets)), [len(cols) for cols in sets]),
+                   program['x'][np.concatenate(sets)], np.ones(sum(len(cols) for cols in sets)), lower=1)
+    logger.info('benders: {} cover rows'.format(len(sets)))
+
+
+class BendersCuts(Conshdlr):
+    '''
+    adds the aggregated optimality cut of every block whose theta is below its subproblem cost
+    '''
+
+    def __init__(self, od, populations, block, x, theta):
+        # every origin's pairs sorted by distance
+        order = np.lexsort((od['cost'], od['rows']))
+        self.rows, self.cols, self.cost = od['rows'][order], od['cols'][order], od['cost'][order]
+        self.row_start = (np.arange(len(order)) == od['indptr'][self.rows])
+        self.row_last = np.r_[self.rows[1:] != self.rows[:-1], True]
+        self.weight = populations[self.rows]
+        self.block = block
+        self.x, self.theta = x, theta
+        self.n_cuts = 0
+
+    def cuts(self, x_value):
+        '''
+        right hand side and x coefficients of every block's cut at x_value:
+        theta_b + sum_d coef[b, d]*x_d >= rhs[b]
+        '''
+        n_blocks, n_destinations = len(self.theta), len(self.x)
+        # cumulative open fraction along each origin's sorted destinations
+        cumulative = np.cumsum(x_value[self.cols])
+        offset = np.where(self.row_start, cumulative - x_value[self.cols], 0)
+        cumulative = cumulative - np.maximum.accumulate(offset)
+        reached = cumulative >= 1 - 1e-9
+        # first level where a whole facility is open (the last destination if never)
+        previous = np.r_[False, reached[:-1]] & ~self.row_start
+        first = np.flatnonzero((reached & ~previous) | (self.row_last & ~reached))
+        c_star = self.cost[first]
+
+        rows = self.rows
+        saving = self.weight*np.maximum(c_star[rows] - self.cost, 0)
+        origin_block = self.block[rows]
+        coef = np.bincount(origin_block*n_destinations + self.cols, weights=saving,
+                           minlength=n_blocks*n_destinations).reshape(n_blocks, n_destinations)
+        rhs = np.bincount(self.block, weights=self.weight[first]*c_star, minlength=n_blocks)
+        return rhs, coef
+
+    def add_cuts(self, solution=None, check_only=False):
+        '''
+        separate the cuts violated by the solution (the current LP/pseudo solution if None)
+        '''
+        x_value = np.array([self.model.getSolVal(solution, x_d) for x_d in self.x])
+        theta_value = np.array([self.model.getSolVal(solution, t) for t in self.theta])
+        rhs, coef = self.cuts(x_value)
+        violated = np.flatnonzero(theta_value + coef @ x_value < rhs - 1e-6*np.maximum(1, np.abs(rhs)))
+        if check_only or len(violated) == 0:
+            return len(violated) > 0
+        for b in violated:
+            nonzero = np.flatnonzero(coef[b])
+            self.model.addCons(self.theta[b] + quicksum(c*self.x[d] for c, d in zip(coef[b, nonzero].tolist(), nonzero))
+                               >= rhs[b], removable=True)
+        self.n_cuts += len(violated)
+        return True
+
+    def add_start(self, x_start):
+        '''
+        cuts at a starting facility set, and the set with its block costs as a primal solution
+        '''
+        x_value = x_start.astype(float)
+        rhs, coef = self.cuts(x_value)
+        theta_value = rhs - coef @ x_value
+        for b in range(len(self.theta)):
+            nonzero = np.flatnonzero(coef[b])
+            self.model.addCons(self.theta[b] + quicksum(c*self.x[d] for c, d in zip(coef[b, nonzero].tolist(), nonzero))
+                               >= rhs[b])
+        self.n_cuts += len(self.theta)
+        sol = self.model.createSol()
+        for x_d, value in zip(self.x, x_value.tolist()):
+            self.model.setSolVal(sol, x_d, value)
+        for t, value in zip(self.theta, theta_value.tolist()):
+            self.model.setSolVal(sol, t, value)
+        self.model.addSol(sol)
+
+    def conscheck(self, constraints, solution, checkintegrality, checklprows, printreason, completely, **kwargs):
+        if self.add_cuts(solution, check_only=True):
+            return {"result": SCIP_RESULT.INFEASIBLE}
+        return {"result": SCIP_RESULT.FEASIBLE}
+
+    def consenfolp(self, constraints, nusefulconss, solinfeasible):
+        if self.add_cuts():
+            return {"result": SCIP_RESULT.CONSADDED}
+        return {"result": SCIP_RESULT.FEASIBLE}
+
+    def consenfops(self, constraints, nusefulconss, solinfeasible, objinfeasible):
+        if self.add_cuts():
+            return {"result": SCIP_RESULT.CONSADDED}
+        return {"result": SCIP_RESULT.FEASIBLE}
+
+    def conssepalp(self, constraints, nusefulconss):
+        if self.add_cuts():
+            return {"result": SCIP_RESULT.CONSADDED}
+        return {"result": SCIP_RESULT.DIDNOTFIND}
+
+    def conslock(self, constraint, locktype, nlockspos, nlocksneg):
+        pass
@@ -0,0 +1,332 @@
+'''
+Shared construction of the facility location models from numpy arrays
+- location arrays: cost matrix, population vector and open mask from the location
+  (see import_location: a float32 distance matrix, dense or CSR, and a population vector)
+- coordinate distances: a distance matrix computed from coordinates when indexed, never stored
+- pair arrays: the (origin, destination) pairs an origin may be assigned to
+- facility program: x columns, number to open and the already open facilities
+- assignment: y columns with the assignment and linking constraints
+
+the cost matrix is origins x destinations, either a dense array (np.inf marks a dropped pair)
+or a scipy sparse matrix holding only the kept pairs. objectives are added on top in optimize.py,
+and solvers.py hands the finished linear program to SCIP or HiGHS
+'''
+
+# import libraries
+from scipy import sparse
+import numpy as np
+import logging
+logging.basicConfig(
+    format='%(asctime)s %(levelname)-8s %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def location_arrays(origins, destinations, populations, distances, open_current, pairs=None):
+    '''
+    the cost matrix (float64), population vector and open mask of a location, indexed by position
+    in origins and destinations (kept to map positions back to ids). distances is the origins x
+    destinations matrix, dense or sparse (then only its stored pairs exist). with pairs (see
+    optimize.sparse_pairs) the cost is sparse
+    '''
+    index = {d: j for j, d in enumerate(destinations)}
+    population = np.asarray(populations, dtype=float)
+    open_mask = np.zeros(len(destinations), dtype=bool)
+    open_mask[[index[d] for d in open_current]] = True
+
+    if pairs is None:
+        cost = sparse.csr_matrix(distances, dtype=float) if sparse.issparse(distances) else np.asarray(distances, dtype=float)
+    else:
+        rows = np.repeat(np.arange(len(origins)), [len(pairs[o]) for o in origins])
+        cols = np.array([index[d] for o in origins for d in pairs[o]], dtype=int)
+        vals = np.asarray(distances[rows, cols], dtype=float).ravel()
+        cost = sparse.csr_matrix((vals, (rows, cols)), shape=(len(origins), len(destinations)))
+    return {'cost': cost, 'populations': population, 'open': open_mask, 'destinations': list(destinations)}
+
+
+class CoordinateDistances:
+    '''
+    the euclidean distances between origin and destination coordinates (n x 2 arrays) with function
+    applied, computed when indexed (like a numpy matrix: [i], [rows, cols] for pairs, [:, cols] for
+    columns) instead of stored. np.asarray computes the whole matrix
+    '''
+
+    def __init__(self, origins, destinations, function=None):
+        self.origins = np.asarray(origins, dtype=float)
+        self.destinations = np.asarray(destinations, dtype=float)
+        self.function = function
+        self.shape = (len(self.origins), len(self.destinations))
+        self.ndim = 2
+
+    def __getitem__(self, key):
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        o, d = self.origins[rows], self.destinations[cols]
+        # a slice with a slice or an array is a block, otherwise the indices broadcast like numpy's
+        if o.ndim == 2 and d.ndim == 2 and (isinstance(rows, slice) or isinstance(cols, slice)):
+            o, d = o[:, None, :], d[None, :, :]
+        distances = np.sqrt(((o - d)**2).sum(axis=-1))
+        return distances if self.function is None else self.function(distances)
+
+    def __array__(self, dtype=None, copy=None):
+        logger.info('computing all {} x {} coordinate distances'.format(*self.shape))
+        return np.asarray(self[:, :], dtype=dtype)
+
+    def transform(self, function):
+        '''
+        the same distances with function applied after this one's
+        '''
+        inner = self.function
+        return CoordinateDistances(self.origins, self.destinations,
+                                   function if inner is None else lambda d: function(inner(d)))
+
+
+def transform(distances, function):
+    '''
+    a float64 copy of a dense or sparse distance matrix with function (vectorized) applied to every distance
+    (a coordinate distance matrix stays implicit)
+    '''
+    if isinstance(distances, CoordinateDistances):
+        return distances.transform(function)
+    if sparse.issparse(distances):
+        transformed = sparse.csr_matrix(distances, dtype=float, copy=True)
+        transformed.data = function(transformed.data)
+        return transformed
+    return function(np.asarray(distances, dtype=float))
+
+
+def nearest_distance(distances, columns=None, block=1024):
+    '''
+    each origin's smallest distance in a dense or sparse distance matrix, only to the destinations
+    at the positions in columns if given. np.inf for an origin without any. a coordinate distance
+    matrix is taken block rows at a time
+    '''
+    if isinstance(distances, CoordinateDistances):
+        cols = slice(None) if columns is None else np.asarray(columns, dtype=int)
+        if len(distances.destinations[cols]) == 0:
+            return np.full(distances.shape[0], np.inf)
+        return np.concatenate([distances[begin:begin + block, cols].min(axis=1)
+                               for begin in range(0, distances.shape[0], block)])
+    if columns is not None:
+        distances = distances[:, np.asarray(columns, dtype=int)]
+    if sparse.issparse(distances):
+        distances = sparse.csr_matrix(distances)
+        nearest = np.full(distances.shape[0], np.inf)
+        nonempty = np.flatnonzero(np.diff(distances.indptr) > 0)
+        nearest[nonempty] = np.minimum.reduceat(distances.data, distances.indptr[nonempty])
+        return nearest
+    if distances.shape[1] == 0:
+        return np.full(distances.shape[0], np.inf)
+    return np.asarray(distances).min(axis=1).astype(float)
+
+
+def row_pairs(distances, i):
+    '''
+    the destination positions and distances of origin i in a dense or sparse distance matrix
+    '''
+    if sparse.issparse(distances):
+        begin, end = distances.indptr[i], distances.indptr[i + 1]
+        return distances.indices[begin:end], distances.data[begin:end]
+    return np.arange(distances.shape[1]), np.asarray(distances[i])
+
+
+def pair_arrays(cost, open_mask=None):
+    '''
+    the kept (origin, destination) pairs, sorted by origin: rows, cols and cost of each pair,
+    and indptr so that origin i's pairs are indptr[i]:indptr[i+1].
+    given the open mask, pairs costing more than the origin's nearest open facility are dropped:
+    that facility stays open, so no objective here would ever assign the origin past it
+    '''
+    if sparse.issparse(cost):
+        cost = sparse.csr_matrix(cost)
+        cost.sort_indices()
+        rows = np.repeat(np.arange(cost.shape[0]), np.diff(cost.indptr))
+        cols, vals = cost.indices, cost.data
+    else:
+        cost = np.asarray(cost, dtype=float)
+        # np.nonzero walks the matrix row by row, so the pairs come out sorted by origin
+        rows, cols = np.nonzero(np.isfinite(cost))
+        vals = cost[rows, cols]
+
+    if open_mask is not None and open_mask.any():
+        nearest_open = np.full(cost.shape[0], np.inf)
+        np.minimum.at(nearest_open, rows, np.where(open_mask[cols], vals, np.inf))
+        keep = vals <= nearest_open[rows]
+        logger.info('dropped {} of {} pairs beyond the nearest open facility'.format(
+            len(vals) - keep.sum(), len(vals)))
+        rows, cols, vals = rows[keep], cols[keep], vals[keep]
+
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=cost.shape[0]))])
+    return {'rows': rows, 'cols': cols, 'cost': vals, 'indptr': indptr}
+
+
+def facility_program(arrays, open_total=None):
+    '''
+    linear program with a binary x_d per destination, the already open ones fixed to 1 through their bounds,
+    and (if open_total is given) the number of open destinations. a program is a dict of arrays:
+    objective, bounds and integrality per column, the constraint matrix as (row, col, val) triplets
+    with lower/upper per row, and the column and row indices later steps need (x, y, cardinality, ...).
+    solvers.py turns it into a SCIP model or solves it with HiGHS
+    '''
+    program = {'obj': np.zeros(0), 'lb': np.zeros(0), 'ub': np.zeros(0), 'integrality': np.zeros(0, dtype=int),
+               'rows': [], 'cols': [], 'vals': [], 'lower': [], 'upper': [], 'n_rows': 0, 'offset': 0.0,
+               'x': None, 'y': None, 'pairs': None, 'open': arrays['open'], 'populations': arrays['populations'],
+               'destinations': arrays['destinations'], 'open_total': open_total, 'cardinality': None}
+    logger.info('set variables')
+    # x_d is binary, 1 if destination d is opened, 0 otherwise
+    n = len(arrays['open'])
+    x = add_columns(program, np.zeros(n), lb=arrays['open'].astype(float), integral=True)
+    program['x'] = x
+    if open_total is not None:
+        # constraint: the sum of open destinations should equal the number we want to be open
+        program['cardinality'] = add_rows(program, np.zeros(n, dtype=int), x, np.ones(n), open_total, open_total)[0]
+    return program
+
+
+def add_columns(program, obj, lb=0.0, ub=1.0, integral=False):
+    '''
+    append a column per objective coefficient, returns their indices
+    '''
+    n = len(obj)
+    first = len(program['obj'])
+    program['obj'] = np.concatenate([program['obj'], obj])
+    program['lb'] = np.concatenate([program['lb'], np.broadcast_to(lb, n)])
+    program['ub'] = np.concatenate([program['ub'], np.broadcast_to(ub, n)])
+    program['integrality'] = np.concatenate([program['integrality'], np.full(n, int(integral))])
+    return np.arange(first, first + n)
+
+
+def add_rows(program, rows, cols, vals, lower=-np.inf, upper=np.inf):
+    '''
+    append constraints lower <= sum(vals*columns) <= upper given as triplets, rows numbered from 0
+    for the new constraints (every one of them should have at least one entry). returns their indices
+    '''
+    n = rows.max() + 1 if len(rows) else 0
+    first = program['n_rows']
+    program['rows'].append(rows + first)
+    program['cols'].append(np.asarray(cols))
+    program['vals'].append(np.asarray(vals, dtype=float))
+    program['lower'].append(np.broadcast_to(np.asarray(lower, dtype=float), n))
+    program['upper'].append(np.broadcast_to(np.asarray(upper, dtype=float), n))
+    program['n_rows'] += n
+    return np.arange(first, first + n)
+
+
+def constraint_matrix(program):
+    '''
+    the constraints as a sparse matrix (sorted by row) with their lower and upper bounds
+    '''
+    rows, cols, vals = (np.concatenate(program[key]) for key in ('rows', 'cols', 'vals'))
+    A = sparse.csr_matrix((vals, (rows, cols)), shape=(program['n_rows'], len(program['obj'])))
+    return A, np.concatenate(program['lower']), np.concatenate(program['upper'])
+
+
+def add_assignment(program, pairs, obj=None, linking='strong'):
+    '''
+    add a binary y per pair, with obj as its objective coefficient, and constrain each origin to
+    be assigned to exactly one open destination. returns the y columns, aligned with the pair arrays.
+    linking 'strong' adds a y_o,d <= x_d row per pair, 'lazy' only one aggregated row per destination,
+    sum_o y_o,d <= n_d*x_d, and keeps the pairs in program['linking'] so that SCIP separates the
+    strong rows its LP solutions violate (see solvers.LinkingCuts)
+    '''
+    x, open_mask = program['x'], program['open']
+    if obj is None:
+        obj = np.zeros(len(pairs['rows']))
+    # y_o,d is binary, 1 if destination d is assigned to origin o, 0 otherwise
+    y = add_columns(program, obj, integral=True)
+
+    logger.info('set constraints')
+    # constraint: each origin can only be assigned a single destination
+    add_rows(program, pairs['rows'], y, np.ones(len(y)), 1, 1)
+    # constraint: an origin cannot be assigned an unopen destination
+    # (nothing to link for destinations that are already open, their x is fixed to 1)
+    closed = np.flatnonzero(~open_mask[pairs['cols']])
+    if linking == 'lazy':
+        # one row per destination, its x weighted by how many origins it can serve
+        destination, link = np.unique(pairs['cols'][closed], return_inverse=True)
+        add_rows(program, np.concatenate([link, np.arange(len(destination))]),
+                 np.concatenate([y[closed], x[destination]]),
+                 np.concatenate([np.ones(len(closed)), -np.bincount(link, minlength=len(destination))]), upper=0)
+        program['linking'] = {'y': y[closed], 'x': pairs['cols'][closed]}
+        logger.info('lazy linking: {} aggregated rows instead of {}'.format(len(destination), len(closed)))
+    else:
+        link = np.arange(len(closed))
+        add_rows(program, np.concatenate([link, link]), np.concatenate([y[closed], x[pairs['cols'][closed]]]),
+                 np.concatenate([np.ones(len(closed)), -np.ones(len(closed))]), upper=0)
+    logger.info('{} assignment variables'.format(len(y)))
+    program['y'], program['pairs'] = y, pairs
+    return y
+
+
+def linking_matrix(program):
+    '''
+    the strong y_o,d - x_d <= 0 rows left out by a lazy linking (see add_assignment), as a sparse matrix
+    '''
+    y, x = program['linking']['y'], program['x'][program['linking']['x']]
+    link = np.arange(len(y))
+    return sparse.csr_matrix((np.concatenate([np.ones(len(y)), -np.ones(len(y))]),
+                              (np.concatenate([link, link]), np.concatenate([y, x]))),
+                             shape=(len(y), len(program['obj'])))
+
+
+def open_facilities(model):
+    '''
+    positions of the destinations that are opened (i.e., their value = 1)
+    '''
+    return np.flatnonzero([int(round(model.getVal(x_d))) for x_d in model.data['x']])
+
+
+def nearest_cost(pairs, open_mask):
+    '''
+    each origin's cost to its nearest open destination among its pairs (np.inf if none is open)
+    '''
+    cost = np.where(open_mask[pairs['cols']], pairs['cost'], np.inf)
+    return np.minimum.reduceat(cost, pairs['indptr'][:-1])
+
+
+def nearest_pair(pairs, open_mask):
+    '''
+    index (into the pair arrays) of each origin's nearest open destination, -1 if none is open
+    '''
+    cost = np.where(open_mask[pairs['cols']], pairs['cost'], np.inf)
+    nearest = np.minimum.reduceat(cost, pairs['indptr'][:-1])
+    candidates = np.flatnonzero((cost == nearest[pairs['rows']]) & np.isfinite(cost))
+    # the first of any ties
+    origin, first = np.unique(pairs['rows'][candidates], return_index=True)
+    index = np.full(len(nearest), -1)
+    index[origin] = candidates[first]
+    return index
+
+
+def unassigned_cost(pairs):
+    '''
+    cost charged to an origin with no open destination, above any real assignment
+    '''
+    return 2*pairs['cost'].max() + 1
+
+
+def warm_start(model, start):
+    '''
+    hand SCIP a starting facility set (positions in destinations, as returned by the models and
+    heuristics) as a primal solution before optimize(). the already open facilities are added to it,
+    and each origin is assigned to its nearest facility in the set. any other variables (w, z) are
+    left for SCIP to complete
+    '''
+    data = model.data
+    x_start = data['open'].copy()
+    x_start[np.asarray(start, dtype=int)] = True
+    if data['open_total'] is not None and x_start.sum() != data['open_total']:
+        logger.warning('warm start opens {} facilities instead of {}, SCIP may reject it'.format(
+            x_start.sum(), data['open_total']))
+
+    sol = model.createPartialSol()
+    for x_d, value in zip(data['x'], x_start.tolist()):
+        model.setSolVal(sol, x_d, value)
+    if data['y'] is not None:
+        y_start = np.zeros(len(data['y']))
+        assigned = nearest_pair(data['pairs'], x_start)
+        y_start[assigned[assigned >= 0]] = 1
+        for y_od, value in zip(data['y'], y_start.tolist()):
+            model.setSolVal(sol, y_od, value)
+    model.addSol(sol)
+    logger.info('warm start with {} open facilities'.format(x_start.sum()))
@@ -0,0 +1,201 @@
+'''
+On-disk cache of solved runs, so an identical configuration returns its result without importing,
+building or solving again
+
+an entry is keyed by a hash of the location's data files, the solver profiles and every config entry
+that can change the result (optimize, epsilon, num_to_open, kpcoef, objective, service, ...). it holds
+the result (result.pkl), the model SCIP solved (model.cip, see solvers.apply_profile) and a manifest.
+the data files are only re-hashed when their size or modification time changes, and when a city's
+files do change its entries are dropped. the least recently used entries are evicted beyond a size limit
+'''
+
+# import libraries
+import os
+import json
+import time
+import pickle
+import shutil
+import hashlib
+import logging
+logging.basicConfig(
+    format='%(asctime)s %(levelname)-8s %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+# config entries that only change how a run is shown or cached, not its result
+IGNORED = ('plot', 'anytime', 'cache', 'cache_dir', 'cache_size', 'export', 'results')
+PROFILES = './config/solver_profiles.yml'
+
+
+def cache_dir(config):
+    return config.get('cache_dir', './cache')
+
+
+def data_files(config):
+    '''
+    the files a run reads its location from (none for the grid)
+    '''
+    if config['location'] == 'grid':
+        return []
+    city_name = config['location'].lower().replace(" ", "_")
+    file_path = './data/' + city_name + '/'
+    return [file_path + city_name + '-' + kind + '.csv' for kind in ('population', 'destinations', 'distances')]
+
+
+def file_hashes(config):
+    '''
+    sha256 of each data file, taken from cache_dir/files.json unless its size or modification time
+    changed. the entries of a city whose files changed are invalidated
+    '''
+    directory = cache_dir(config)
+    index_path = os.path.join(directory, 'files.json')
+    index = {}
+    try:
+        with open(index_path) as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        # no index yet, or an unreadable one: every file is hashed again
+        pass
+
+    hashes, changed = {}, False
+    for path in data_files(config):
+        stat = os.stat(path)
+        known = index.get(path)
+        if known is not None and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime_ns:
+            hashes[path] = known['sha256']
+            continue
+        logger.info('cache: hashing {}'.format(path))
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        hashes[path] = digest.hexdigest()
+        if known is not None and known['sha256'] != hashes[path]:
+            changed = True
+        index[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': hashes[path]}
+
+    # written to a file of this process and renamed, so runs in parallel (see batch.py) never read half of it
+    os.makedirs(directory, exist_ok=True)
+    temporary = '{}.{}.tmp'.format(index_path, os.getpid())
+    with open(temporary, 'w') as file:
+        json.dump(index, file, indent=1)
+    os.replace(temporary, index_path)
+    if changed:
+        invalidate(config['location'], directory)
+    return hashes
+
+
+def key(config):
+    '''
+    hash of everything the result of a config depends on
+    '''
+    content = {'config': {name: value for name, value in config.items() if name not in IGNORED},
+               'files': file_hashes(config)}
+    if (config.get('profile') is not None or config.get('race') is not None) and os.path.exists(PROFILES):
+        with open(PROFILES, 'rb') as file:
+            content['profiles'] = hashlib.sha256(file.read()).hexdigest()
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def entry(config, run_key):
+    return os.path.join(cache_dir(config), run_key)
+
+
+def load(config, run_key):
+    '''
+    the cached result of a run, None if there is none
+    '''
+    path = os.path.join(entry(config, run_key), 'result.pkl')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as file:
+        result = pickle.load(file)
+    # last used, for the eviction
+    os.utime(os.path.join(entry(config, run_key), 'manifest.json'))
+    logger.info('cache: returning the result of run {}'.format(run_key[:12]))
+    return result
+
+
+def store(config, run_key, result):
+    '''
+    keep the result of a run (and the model file SCIP exported to model_path, if any), then evict beyond
+    config['cache_size'] megabytes (default 1024)
+    '''
+    directory = entry(config, run_key)
+    os.makedirs(directory, exist_ok=True)
+    exported = model_path(config, run_key)
+    if os.path.exists(exported):
+        os.replace(exported, os.path.join(directory, 'model.cip'))
+    with open(os.path.join(directory, 'result.pkl'), 'wb') as file:
+        pickle.dump(result, file)
+    with open(os.path.join(directory, 'manifest.json'), 'w') as file:
+        json.dump({'location': config['location'], 'optimize': config['optimize'], 'created': time.time(),
+                   'files': data_files(config)}, file, indent=1)
+    logger.info('cache: stored run {}'.format(run_key[:12]))
+    evict(cache_dir(config), config.get('cache_size', 1024)*2**20, keep=run_key)
+
+
+def model_path(config, run_key):
+    '''
+    where SCIP exports the model of a run (see solvers.apply_profile): a file of this process next to
+    the entries, which store moves into the entry. a run that fails leaves no entry without a manifest
+    '''
+    os.makedirs(cache_dir(config), exist_ok=True)
+    return os.path.join(cache_dir(config), '{}.{}.cip.tmp'.format(run_key, os.getpid()))
+
+
+def entries(directory):
+    '''
+    the cached runs with their manifest, size in bytes and last use
+    '''
+    runs = []
+    if not os.path.isdir(directory):
+        return runs
+    for name in os.listdir(directory):
+        manifest_path = os.path.join(directory, name, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            continue
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+        size = sum(entry.stat().st_size for entry in os.scandir(os.path.join(directory, name)) if entry.is_file())
+        runs.append({'key': name, 'manifest': manifest, 'size': size, 'used': os.path.getmtime(manifest_path)})
+    return runs
+
+
+def evict(directory, max_bytes, keep=None):
+    '''
+    remove the least recently used runs until the cache is within max_bytes, and what runs that failed
+    more than a day ago left behind: exported models and entries without a manifest
+    '''
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if time.time() - os.path.getmtime(path) < 86400:
+            continue
+        if name.endswith('.cip.tmp'):
+            os.remove(path)
+        elif os.path.isdir(path) and not os.path.exists(os.path.join(path, 'manifest.json')):
+            shutil.rmtree(path, ignore_errors=True)
+    runs = sorted(entries(directory), key=lambda run: run['used'])
+    total = sum(run['size'] for run in runs)
+    for run in runs:
+        if total <= max_bytes:
+            break
+        if run['key'] == keep:
+            continue
+        shutil.rmtree(os.path.join(directory, run['key']))
+        total -= run['size']
+        logger.info('cache: evicted run {} ({:.1f} MB)'.format(run['key'][:12], run['size']/2**20))
+
+
+def invalidate(location, directory='./cache'):
+    '''
+    remove every cached run of a location, e.g. after its CSVs changed
+    '''
+    removed = 0
+    for run in entries(directory):
+        if run['manifest']['location'] == location:
+            shutil.rmtree(os.path.join(directory, run['key']))
+            removed += 1
+    logger.info('cache: invalidated {} runs of {}'.format(removed, location))
+    return removed
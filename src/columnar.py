@@ -0,0 +1,243 @@
+'''
+Memory-mappable binary copy of a city's CSVs, so a run does not parse the distances CSV again
+
+the population, destinations and distances CSVs of a city are converted once into one .npy file per
+column in data/<city>/columnar/ (ids as int64, distances as float32, dest_type as fixed width text),
+with a manifest of the size, modification time and sha256 of each CSV. load maps the columns lazily
+(np.load with mmap_mode), so only the pages that are used are read. when a CSV's size or modification
+time changed it is hashed again, and the columns are converted again if its content changed.
+a conversion is written to a directory of its own process and moved into place whole, so runs in
+parallel (see batch.py) never see a partial copy, and load checks every column against the row counts
+in the manifest
+'''
+
+# import libraries
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+import logging
+logging.basicConfig(
+    format='%(asctime)s %(levelname)-8s %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+# the columns kept of each CSV and their dtype in the binary copy (dest_type is converted to text)
+COLUMNS = {'population': {'geoid10': np.int64, 'H7X001': np.float64},
+           'destinations': {'id_dest': np.int64, 'dest_type': str, 'closed': np.int8},
+           'distances': {'id_orig': np.int64, 'id_dest': np.int64, 'distance': np.float32}}
+
+
+def source_files(city_name, file_path):
+    return {kind: file_path + city_name + '-' + kind + '.csv' for kind in COLUMNS}
+
+
+def read_csvs(city_name, file_path, kinds=tuple(COLUMNS)):
+    '''
+    the kept columns of a city's CSVs (those in kinds) as arrays, by CSV and column (closed only if the
+    destinations have it)
+    '''
+    tables = {}
+    for kind, path in source_files(city_name, file_path).items():
+        if kind in kinds:
+            logger.info('importing {}'.format(path))
+            tables[kind] = next(csv_chunks(path, kind))
+    return tables
+
+
+def csv_chunks(path, kind, chunk_size=None):
+    '''
+    the kept columns of a CSV in their compact dtypes, by column, for every chunk of chunk_size rows
+    (a single chunk if None)
+    '''
+    header = pd.read_csv(path, nrows=0).columns
+    columns = {name: dtype for name, dtype in COLUMNS[kind].items() if name in header}
+    frames = pd.read_csv(path, usecols=list(columns), chunksize=chunk_size,
+                         dtype={name: dtype for name, dtype in columns.items() if dtype is not str})
+    for frame in ([frames] if chunk_size is None else frames):
+        yield {name: frame[name].to_numpy(dtype=dtype) for name, dtype in columns.items()}
+
+
+def array_chunks(columns, chunk_size):
+    '''
+    the columns (e.g. memory-mapped by load) in slices of chunk_size rows
+    '''
+    length = len(next(iter(columns.values())))
+    for begin in range(0, length, chunk_size):
+        yield {name: np.asarray(values[begin:begin + chunk_size]) for name, values in columns.items()}
+
+
+def filter_distances(chunks, origins, destinations):
+    '''
+    id_orig, id_dest and distance of the rows from origins to destinations, filtering every chunk of the
+    distances as it is read so only the kept rows are ever held together
+    '''
+    kept, total = [], 0
+    for chunk in chunks:
+        keep = np.isin(chunk['id_orig'], origins) & np.isin(chunk['id_dest'], destinations)
+        kept.append([chunk[name][keep] for name in ('id_orig', 'id_dest', 'distance')])
+        total += len(keep)
+    if len(kept) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    id_orig, id_dest, distance = (np.concatenate(columns) for columns in zip(*kept))
+    logger.info('kept {} of {} distances'.format(len(distance), total))
+    return id_orig, id_dest, distance
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_current(sources, manifest_path):
+    '''
+    whether the binary copy described by the manifest matches the CSVs, hashing a CSV only if its size or
+    modification time changed (the manifest is updated when the content is unchanged)
+    '''
+    try:
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return False
+    touched = False
+    for kind, path in sources.items():
+        known, stat = manifest['files'].get(kind), os.stat(path)
+        if known is None:
+            return False
+        if known['size'] == stat.st_size and known['mtime'] == stat.st_mtime_ns:
+            continue
+        if known['size'] != stat.st_size or known['sha256'] != file_hash(path):
+            logger.info('columnar: {} changed'.format(path))
+            return False
+        known['mtime'] = stat.st_mtime_ns
+        touched = True
+    if touched:
+        write_manifest(manifest, manifest_path)
+    return True
+
+
+def write_manifest(manifest, manifest_path):
+    '''
+    write the manifest to a file of this process and rename it, so no run reads half of it
+    '''
+    temporary = '{}.{}.tmp'.format(manifest_path, os.getpid())
+    with open(temporary, 'w') as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(temporary, manifest_path)
+
+
+def convert(city_name, file_path, chunk_size=1000000):
+    '''
+    write the binary copy of a city's CSVs with its manifest to a directory of this process, then move
+    it to file_path/columnar/ (see publish). the CSVs are read chunk_size rows at a time and every numeric
+    column is appended to a raw file, which becomes the .npy once the number of rows is known, so the
+    conversion never holds a whole CSV (text columns, only in the small destinations CSV, are kept whole)
+    '''
+    directory = os.path.join(file_path, 'columnar')
+    temporary = '{}.{}.tmp'.format(directory, os.getpid())
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    sources = source_files(city_name, file_path)
+    manifest = {'files': {}, 'columns': {}, 'rows': {}}
+    for kind, path in sources.items():
+        logger.info('columnar: converting {}'.format(path))
+        raw, text, rows = {}, {}, 0
+        for chunk in csv_chunks(path, kind, chunk_size):
+            for name, values in chunk.items():
+                if values.dtype.kind == 'U':
+                    text.setdefault(name, []).append(values)
+                    continue
+                if name not in raw:
+                    raw[name] = (open(os.path.join(temporary, '{}-{}.raw'.format(kind, name)), 'wb'), values.dtype)
+                values.tofile(raw[name][0])
+            rows += len(next(iter(chunk.values())))
+        for name, (file, dtype) in raw.items():
+            file.close()
+            write_npy(os.path.join(temporary, '{}-{}'.format(kind, name)), dtype, rows)
+        for name, values in text.items():
+            np.save(os.path.join(temporary, '{}-{}.npy'.format(kind, name)), np.concatenate(values))
+        manifest['columns'][kind] = [name for name in COLUMNS[kind] if name in raw or name in text]
+        manifest['rows'][kind] = rows
+
+        stat = os.stat(path)
+        manifest['files'][kind] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': file_hash(path)}
+    with open(os.path.join(temporary, 'manifest.json'), 'w') as file:
+        json.dump(manifest, file, indent=1)
+    publish(temporary, directory)
+    logger.info('columnar: converted the CSVs of {} to {}'.format(city_name, directory))
+    return manifest
+
+
+def publish(temporary, directory):
+    '''
+    move a finished conversion to directory, moving a stale copy aside first. if another run put its
+    copy there in between, that one is kept and this one dropped
+    '''
+    aside = '{}.{}.old'.format(directory, os.getpid())
+    try:
+        os.replace(temporary, directory)
+    except OSError:
+        try:
+            os.replace(directory, aside)
+            os.replace(temporary, directory)
+        except OSError:
+            logger.info('columnar: another run already converted to {}'.format(directory))
+    shutil.rmtree(temporary, ignore_errors=True)
+    shutil.rmtree(aside, ignore_errors=True)
+
+
+def write_npy(stem, dtype, rows):
+    '''
+    turn the raw column stem.raw (rows values of dtype) into stem.npy, copying it in blocks
+    '''
+    with open(stem + '.npy', 'wb') as target, open(stem + '.raw', 'rb') as source:
+        np.lib.format.write_array_header_1_0(target, {'descr': np.lib.format.dtype_to_descr(dtype),
+                                                      'fortran_order': False, 'shape': (rows,)})
+        shutil.copyfileobj(source, target, 1 << 24)
+    os.remove(stem + '.raw')
+
+
+def load(city_name, file_path, chunk_size=1000000):
+    '''
+    the columns of a city's CSVs (as read_csvs) memory-mapped from the binary copy, converting the CSVs
+    first (chunk_size rows at a time) if there is no copy, it is stale or a column does not have the
+    rows of the manifest
+    '''
+    directory = os.path.join(file_path, 'columnar')
+    tables = None
+    if is_current(source_files(city_name, file_path), os.path.join(directory, 'manifest.json')):
+        tables = mapped(directory)
+    if tables is None:
+        convert(city_name, file_path, chunk_size)
+        tables = mapped(directory)
+    if tables is None:
+        raise ValueError('columnar: the binary copy in {} is incomplete after converting'.format(directory))
+    logger.info('columnar: mapping {}'.format(directory))
+    return tables
+
+
+def mapped(directory):
+    '''
+    every column of the binary copy in directory memory-mapped, None if the manifest has no row counts
+    or a column cannot be read or has another length
+    '''
+    try:
+        with open(os.path.join(directory, 'manifest.json')) as file:
+            manifest = json.load(file)
+        tables = {kind: {name: np.load(os.path.join(directory, '{}-{}.npy'.format(kind, name)), mmap_mode='r')
+                         for name in columns}
+                  for kind, columns in manifest['columns'].items()}
+        rows = manifest['rows']
+    except (OSError, ValueError, EOFError, KeyError):
+        return None
+    for kind, columns in tables.items():
+        if any(len(values) != rows.get(kind) for values in columns.values()):
+            logger.warning('columnar: {} in {} does not have {} rows'.format(kind, directory, rows.get(kind)))
+            return None
+    return tables
@@ -0,0 +1,110 @@
+'''
+Score facility sets without solving anything: for every set, the Kolm-Pollak EDE, the population
+weighted mean distance and the max distance of the origins to their nearest open facility
+
+a batch of sets is scored in one pass: the distances to the destinations in any of the sets are taken
+once (a dense block, np.inf for the pairs missing from a sparse location), and each origin's nearest
+facility of every set is a min over that block. the already open facilities are open in every set
+(as in the models) unless with_existing is False. the EDE is (1/alpha)*ln(sum_o populations[o]*e^(alpha*d_o)
+/ sum_o populations[o]), alpha as from import_location.calculate_kappa, computed with logsumexp
+'''
+
+# import libraries
+import numpy as np
+from scipy import sparse
+from scipy.special import logsumexp
+import build
+import logging
+logging.basicConfig(
+    format='%(asctime)s %(levelname)-8s %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def columns(distances, cols):
+    '''
+    the origins x len(cols) dense block of a dense, sparse or coordinate distance matrix, np.inf where
+    a sparse matrix has no distance
+    '''
+    if not sparse.issparse(distances):
+        return np.asarray(distances[:, cols], dtype=float)
+    block = sparse.csc_matrix(distances)[:, cols].tocoo()
+    dense = np.full(block.shape, np.inf)
+    dense[block.row, block.col] = block.data
+    return dense
+
+
+def positions(location, facility_sets):
+    '''
+    the facility sets (lists of destination ids) as an array of positions in destinations, one row per
+    set, shorter sets padded with their first facility (which leaves every nearest distance unchanged)
+    '''
+    index = location['destination_index']
+    sets = [[index[d] for d in facilities] for facilities in facility_sets]
+    size = max([len(facilities) for facilities in sets] + [1])
+    padded = np.full((len(sets), size), -1, dtype=int)
+    for k, facilities in enumerate(sets):
+        if len(facilities) > 0:
+            padded[k] = facilities + facilities[:1]*(size - len(facilities))
+    return padded
+
+
+def nearest(location, facility_sets, with_existing=True, max_block=2**24):
+    '''
+    origins x sets matrix of each origin's distance to the nearest facility of each set (np.inf if none),
+    taking the sets in chunks so no intermediate has more than max_block entries
+    '''
+    distances, sets = location['distances'], positions(location, facility_sets)
+    n = distances.shape[0]
+    base = np.full(n, np.inf)
+    if with_existing and len(location['existing']) > 0:
+        base = build.nearest_distance(distances, [location['destination_index'][d] for d in location['existing']])
+
+    # the distances to every destination in any set, taken once
+    union = np.unique(sets[sets >= 0])
+    block = columns(distances, union)
+    local = np.searchsorted(union, np.maximum(sets, 0))
+    empty = sets[:, 0] < 0
+
+    result = np.empty((n, len(sets)))
+    chunk = max(1, max_block//max(1, n*sets.shape[1]))
+    for begin in range(0, len(sets), chunk):
+        end = min(begin + chunk, len(sets))
+        if len(union) > 0:
+            result[:, begin:end] = block[:, local[begin:end]].min(axis=2)
+        else:
+            result[:, begin:end] = np.inf
+        result[:, begin:end][:, empty[begin:end]] = np.inf
+        np.minimum(result[:, begin:end], base[:, None], out=result[:, begin:end])
+    return result
+
+
+def scores(nearest_distances, populations, alpha=None):
+    '''
+    the kolm pollak EDE (if alpha is given), population weighted mean and max of the origins x sets
+    nearest distances, one value per set
+    '''
+    populations = np.asarray(populations, dtype=float)
+    total = populations.sum()
+    result = {'mean': populations @ nearest_distances/total,
+              'max': nearest_distances[populations > 0].max(axis=0)}
+    if alpha is not None:
+        if alpha == 0:
+            result['kolmpollak'] = result['mean']
+        else:
+            log_mean = logsumexp(alpha*nearest_distances, b=populations[:, None], axis=0) - np.log(total)
+            result['kolmpollak'] = log_mean/alpha
+    return result
+
+
+def evaluate(location, facility_sets, with_existing=True, max_block=2**24):
+    '''
+    the kolm pollak EDE (with location['alpha'], if the location has it), the population weighted mean
+    distance and the max distance of every facility set (lists of destination ids, e.g. the facilities
+    of a result), as arrays aligned with facility_sets. distances must be untransformed
+    '''
+    distances = nearest(location, facility_sets, with_existing, max_block)
+    result = scores(distances, location['populations'], location.get('alpha'))
+    logger.info('evaluated {} facility sets'.format(len(facility_sets)))
+    return result
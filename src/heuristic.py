@@ -0,0 +1,101 @@
+'''
+Greedy construction and interchange (Teitz-Bart, with the fast swap evaluation of Whitaker)
+heuristic for the population weighted assignment objective
+- p median on the distances
+- kolm pollak on distances that are already e^(alpha*d[o,d])
+
+the already open facilities are fixed, and open_total facilities are open in the end
+'''
+
+# import libraries
+import numpy as np
+import build
+import nearest
+import solvers
+import time
+import logging
+logging.basicConfig(
+    format='%(asctime)s %(levelname)-8s %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def heuristic(origins, destinations, populations, distances, open_total, open_current, pairs=None, max_swaps=1000):
+    '''
+    returns the result (see solvers.result) of the facility set found, without a bound
+    '''
+    begin = time.time()
+    arrays = build.location_arrays(origins, destinations, populations, distances, open_current, pairs)
+    od = build.pair_arrays(arrays['cost'], arrays['open'])
+    build_time = time.time() - begin
+    begin = time.time()
+    x = greedy(od, arrays['populations'], arrays['open'], open_total)
+    x = interchange(od, arrays['populations'], x, arrays['open'], max_swaps)
+    objective = arrays['populations'] @ build.nearest_cost(od, x)
+    logger.info('heuristic objective {:.6g}'.format(objective))
+    return solvers.result(destinations, np.flatnonzero(x), objective=objective, status='heuristic',
+                          build_time=build_time, solve_time=time.time() - begin)
+
+
+def greedy(od, populations, open_mask, open_total):
+    '''
+    starting from the open facilities, repeatedly open the destination that saves the most
+    '''
+    rows, cols = od['rows'], od['cols']
+    big = build.unassigned_cost(od)
+    x = open_mask.copy()
+    current = np.minimum(build.nearest_cost(od, x), big)
+    for _ in range(open_total - open_mask.sum()):
+        saving = np.bincount(cols, weights=populations[rows]*np.maximum(current[rows] - od['cost'], 0),
+                             minlength=len(x))
+        saving[x] = -1
+        d = np.argmax(saving)
+        x[d] = True
+        # origins that are now closer to d
+        to_d = cols == d
+        np.minimum.at(current, rows[to_d], od['cost'][to_d])
+    return x
+
+
+def interchange(od, populations, x, open_mask, max_swaps=1000):
+    '''
+    swap an open facility for a closed one while it improves the objective, taking the best
+    swap each time. the facilities in open_mask are never closed. every origin's two nearest open
+    facilities are kept up to date through the swaps (see nearest.NearestIndex)
+    '''
+    rows, cols, cost = od['rows'], od['cols'], od['cost']
+    index = nearest.NearestIndex(od, populations, x)
+    x = index.x
+    weight = populations[rows]
+    swaps = 0
+    while swaps < max_swaps:
+        served, first, second = index.nearest, index.first_cost, index.second_cost
+        movable = np.flatnonzero(x & ~open_mask)
+        if len(movable) == 0:
+            break
+        position = np.full(len(x), -1)
+        position[movable] = np.arange(len(movable))
+
+        # gain of opening each destination: origins that would move to it
+        gain = np.bincount(cols, weights=weight*np.maximum(first[rows] - cost, 0), minlength=len(x))
+        # loss of closing each open facility: its origins fall back to their second nearest
+        assigned = served >= 0
+        loss = np.bincount(served[assigned], weights=populations[assigned]*(second - first)[assigned], minlength=len(x))
+        # origins of the closed facility that the opened one serves better than their second nearest
+        # are counted in the loss but saved by the swap
+        close = np.where(served[rows] >= 0, position[served[rows]], -1)
+        extra_pairs = (close >= 0) & (cost < second[rows]) & ~x[cols]
+        extra = np.zeros((len(x), len(movable)))
+        np.add.at(extra, (cols[extra_pairs], close[extra_pairs]),
+                  weight[extra_pairs]*(second[rows[extra_pairs]] - np.maximum(cost[extra_pairs], first[rows[extra_pairs]])))
+
+        profit = gain[:, None] - loss[movable][None, :] + extra
+        profit[x] = -np.inf
+        d_in, k_out = np.unravel_index(np.argmax(profit), profit.shape)
+        if profit[d_in, k_out] <= 1e-9*max(populations @ first, 1):
+            break
+        index.swap(d_in, movable[k_out])
+        swaps += 1
+    logger.info('interchange: {} swaps'.format(swaps))
+    return x.copy()
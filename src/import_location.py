@@ -1,13 +1,21 @@
 '''
 Import the variables for the location
+
+the location is a dict of origins and destinations (lists of ids, with origin_index and
+destination_index mapping ids to positions), existing (the open destinations), populations (a vector
+over the origins) and distances (an origins x destinations float32 matrix: dense, or a scipy CSR
+matrix holding only the pairs in the data if some are missing, or for an implicit grid a
+build.CoordinateDistances computed when indexed)
 '''
 
-import math
 import numpy as np
 import matplotlib.pyplot as plt
 import random
 import pandas as pd
+from scipy import sparse
 import inequalipy as ineq
+import build
+import columnar
 import logging
 logging.basicConfig(
     format='%(asctime)s %(levelname)-8s %(message)s',
@@ -18,7 +26,7 @@ logger = logging.getLogger(__name__)
 
 def main(config):
     if config['location'] == 'grid':
-        location = create_grid(config['grid_size'])
+        location = create_grid(config['grid_size'], implicit=config.get('implicit', False))
     else:
         # import the data from the folder
         city_name = config['location'].lower().replace(" ", "_")
@@ -36,84 +44,103 @@ def main(config):
     elif config['optimize'] == 'set_kpcoef':
         # calculate kappa
         location['alpha'] = calculate_kappa(location, config) 
+    elif config['optimize'] in ('kp_lagrangian', 'kp_heuristic', 'kp_benders'):
+        # calculate kappa
+        location['alpha'] = calculate_kappa(location, config)
 
-    location['populations'] = location['populations']['population'].to_dict()
-    location['distances'] = location['distances']['distance'].to_dict()
-    #print('location of distandes',location['distances'])
     return location
 
 
-def create_grid(grid_size):
+def distance_matrix(origin_ids, destination_ids, values, origins, destinations):
+    '''
+    the origins x destinations float32 matrix of the distances values[k] from origin_ids[k] to
+    destination_ids[k]: dense if every pair is there, CSR otherwise
+    '''
+    rows = pd.Index(origins).get_indexer(origin_ids)
+    cols = pd.Index(destinations).get_indexer(destination_ids)
+    values = np.asarray(values, dtype=np.float32)
+    if len(values) == len(origins)*len(destinations):
+        matrix = np.empty((len(origins), len(destinations)), dtype=np.float32)
+        matrix[rows, cols] = values
+        return matrix
+    logger.info('{} of {} distances in the data, keeping them sparse'.format(len(values), len(origins)*len(destinations)))
+    return sparse.csr_matrix((values, (rows, cols)), shape=(len(origins), len(destinations)))
+
+
+def create_grid(grid_size, implicit=False):
+    '''
+    the grid_size x grid_size grid with an origin and a destination of population 1 in every cell,
+    numbered row by row. the distances are computed at once from the cell coordinates, or kept implicit
+    (see build.CoordinateDistances) so the (grid_size^2)^2 matrix is never stored
+    '''
     logger.info('generating the grid')
     # create the origins and destinations
     origins = [z for z in range(0, (grid_size*grid_size))]
     destinations = origins.copy()
 
-    # init population weighting
-    populations = pd.DataFrame(1, index=origins, columns=['population'])
-    populations.index.set_names('origin',inplace=True)
-
-    # calculate distances
-    distances = []
-    for j in origins:
-        for i in destinations:
-            # Rounds value down so number of squared in vertical direction can be calculated
-            vert_distance = abs(math.floor(i/grid_size) - math.floor(j/grid_size))
-            horiz_distance = abs((i % grid_size) - j % grid_size)
-            distance = math.sqrt((horiz_distance)**2 + (vert_distance)**2)
-            distances.append([j, i, distance])
-    distances = pd.DataFrame(distances, columns=['origin','destination','distance'])
-    distances.set_index(['origin','destination'], inplace=True)
-
-    return {'origins': origins, 'destinations': destinations, 'populations': populations, 'distances': distances, 'existing': []}
+    # cell coordinates: the column (i % grid_size) and the row (i // grid_size, rounded down)
+    cells = np.arange(grid_size*grid_size)
+    coordinates = np.column_stack([cells % grid_size, cells // grid_size])
+    distances = build.CoordinateDistances(coordinates, coordinates)
+    if not implicit:
+        distances = np.asarray(distances, dtype=np.float32)
+
+    location = {'origins': origins, 'destinations': destinations, 'populations': np.ones(len(origins)),
+                'distances': distances, 'existing': []}
+    location['origin_index'] = {o: i for i, o in enumerate(origins)}
+    location['destination_index'] = {d: j for j, d in enumerate(destinations)}
+    return location
 
 
 def import_files(city_name, config):
+    '''
+    the location of a city from its CSVs, through their memory-mapped binary copy (see columnar.py)
+    unless config['columnar'] is False
+    '''
     file_path = './data/' + city_name + '/'
+    chunk_size = config.get('chunk_size', 1000000)
+    if config.get('columnar', True):
+        tables = columnar.load(city_name, file_path, chunk_size)
+    else:
+        tables = columnar.read_csvs(city_name, file_path, kinds=('population', 'destinations'))
 
-    # populations as a df with origins as index
+    # populations, keeping only populated locations
     logger.info('importing the population')
-    populations = pd.read_csv(file_path + city_name + '-population.csv')
-    # keep only populated locations
-    # populations = populations[populations['U7B001'] > 0]
-    # populations.rename(columns={'id_orig': 'origin', 'U7B001':'population'}, inplace=True)
-    populations = populations[populations['H7X001'] > 0]
-    # print(populations)
-    populations.rename(columns={'geoid10': 'origin', 'H7X001':'population'}, inplace=True)
-    #what does line below do again? 
-    populations = populations[['population', 'origin']]
-    # print(populations)
-    populations.set_index(['origin'], inplace=True)
-   
+    population = tables['population']
+    populated = np.asarray(population['H7X001']) > 0
+    populations = pd.Series(np.asarray(population['H7X001'])[populated],
+                            index=np.asarray(population['geoid10'])[populated])
+
     # destinations as a list
     logger.info('importing the destinations')
-    destinations_df = pd.read_csv(file_path + city_name + '-destinations.csv')
+    id_dest, dest_type = np.asarray(tables['destinations']['id_dest']), np.asarray(tables['destinations']['dest_type'])
     if config['objective'] == 'restore':
-        destinations = destinations_df.loc[destinations_df['dest_type']==config['service'],'id_dest'].unique().tolist()
+        destinations = pd.unique(id_dest[dest_type == config['service']]).tolist()
         # identify open stores
-        open_current = destinations_df.loc[(destinations_df['closed'] == 0) & (
-            destinations_df['dest_type'] == config['service']),'id_dest'].tolist()
+        closed = np.asarray(tables['destinations']['closed'])
+        open_current = id_dest[(closed == 0) & (dest_type == config['service'])].tolist()
     elif config['objective']=='add':
-        destinations = destinations_df.loc[destinations_df['dest_type'].isin([config['service'],config['candidate']]), 'id_dest'].unique().tolist()
-        open_current = destinations_df.loc[destinations_df['dest_type']
-                                            == config['service'], 'id_dest'].unique().tolist()
+        destinations = pd.unique(id_dest[np.isin(dest_type, [config['service'], config['candidate']])]).tolist()
+        open_current = pd.unique(id_dest[dest_type == config['service']]).tolist()
 
-    # distances as a df with multi-index: ['origin','destination']
+    # distances of the inhabited origins to the destinations, filtered chunk by chunk while reading
     logger.info('importing the distances')
-    distances = pd.read_csv(file_path + city_name + '-distances.csv')
-    # get origins that are inhabited
-    distances = distances.loc[distances['id_orig'].isin(populations.index)]
-    distances = distances.loc[distances['id_dest'].isin(destinations)]
-    distances.rename(columns={'id_orig': 'origin', 'id_dest': 'destination'}, inplace=True)
-    distances = distances[['origin', 'destination', 'distance']]
-    distances.set_index(['origin', 'destination'], inplace=True)
-    distances.sort_index(level=[0,1], inplace=True)
-
-    # origins as a list
-    origins = distances.index.get_level_values(0).unique().tolist()
-    
+    if config.get('columnar', True):
+        chunks = columnar.array_chunks(tables['distances'], chunk_size)
+    else:
+        chunks = columnar.csv_chunks(columnar.source_files(city_name, file_path)['distances'], 'distances', chunk_size)
+    id_orig, id_dest, distance = columnar.filter_distances(chunks, populations.index.to_numpy(), destinations)
+
+    # origins as a sorted list
+    origins = np.unique(id_orig).tolist()
+
+    location = {'origins': origins, 'destinations': destinations, 'existing': open_current,
+                'distances': distance_matrix(id_orig, id_dest, distance, origins, destinations),
+                'populations': populations.reindex(origins).to_numpy(dtype=float)}
+    location['origin_index'] = {o: i for i, o in enumerate(origins)}
+    location['destination_index'] = {d: j for j, d in enumerate(destinations)}
     logger.info('data imported')
-    return {'origins': origins, 'destinations': destinations, 'populations': populations, 'distances': distances, 'existing': open_current}
+    return location
 
 
 def calculate_kappa(location, config):
@@ -124,15 +151,13 @@ def calculate_kappa(location, config):
         # randomly choose some to open for purpose of calculating kappa
         open_current = random.sample(location['destinations'], max(1, config['grid_size']//2))
     
-    # determine the nearest distances
-    distances = location['distances']
-    #print('distances',distances)
-    distances_open = distances.loc[pd.IndexSlice[:, open_current], :]
-    nearest = distances_open.groupby('origin')['distance'].min().values
-    #print('nearest',nearest)
-
-    # calculate the alpha value
-    kappa = ineq.kolmpollak.calc_kappa(nearest, epsilon = config['epsilon'], weights=location['populations'].values)
+    # determine the nearest distances (of the origins with a distance to an open facility)
+    nearest = build.nearest_distance(location['distances'], [location['destination_index'][d] for d in open_current])
+    reached = np.isfinite(nearest)
+
+    # calculate the alpha value. the weights go in as a column, as the population column of the data frame
+    # did before: calc_kappa broadcasts it, which keeps alpha (and every kp result) as in earlier runs
+    kappa = ineq.kolmpollak.calc_kappa(nearest[reached], epsilon = config['epsilon'], weights=location['populations'][reached][:, None])
     alpha = -kappa
     print(alpha)
 
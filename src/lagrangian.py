@@ -0,0 +1,134 @@
+'''
+Lagrangian relaxation of the population weighted assignment objective shared by
+p median and kolm pollak exact linearisation (where distances are already e^(alpha*d[o,d]))
+
+the assignment constraints sum_d y_o,d = 1 are relaxed with multipliers lambda_o. the
+subproblem then separates by destination: opening d is worth
+rho_d = sum_o min(0, populations[o]*distances[o,d] - lambda_o), so the best facility set is
+the already open ones plus the most negative rho_d. every facility set is scored as a
+feasible solution, and the multipliers are updated by subgradient steps. the best set is
+finally improved by interchange (heuristic.py)
+'''
+
+# import libraries
+import numpy as np
+import build
+import heuristic
+import solvers
+import time
+import logging
+logging.basicConfig(
+    format='%(asctime)s %(levelname)-8s %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def lagrangian(origins, destinations, populations, distances, open_total, open_current, pairs=None,
+               max_iter=500, gap_tol=1e-4):
+    '''
+    returns the result (see solvers.result): the best facility set found, with the lagrangian
+    lower bound as its bound. infeasible with no facilities if no facility set of open_total serves
+    every origin
+    '''
+    begin = time.time()
+    arrays = build.location_arrays(origins, destinations, populations, distances, open_current, pairs)
+    od = build.pair_arrays(arrays['cost'], arrays['open'])
+    build_time = time.time() - begin
+    begin = time.time()
+    relaxation = relax(od, arrays['populations'], arrays['open'], open_total, max_iter, gap_tol)
+    if relaxation['status'] == 'infeasible':
+        return(solvers.result(destinations, [], status='infeasible', build_time=build_time,
+                              solve_time=time.time() - begin))
+    return(solvers.result(destinations, relaxation['open'], objective=relaxation['upper_bound'],
+                          bound=relaxation['lower_bound'], status=relaxation['status'],
+                          build_time=build_time, solve_time=time.time() - begin))
+
+
+def relax(od, populations, open_mask, open_total, max_iter=500, gap_tol=1e-4):
+    '''
+    subgradient optimization of the lagrangian dual on the pair arrays from build.pair_arrays. the
+    status is infeasible, with no facility set, if open_total is fewer than the open facilities or more
+    than there are destinations, or if no facility set found serves every origin
+    '''
+    rows, cols = od['rows'], od['cols']
+    n_origins, n_destinations = len(od['indptr']) - 1, len(open_mask)
+    n_new = open_total - open_mask.sum()
+    candidates = np.flatnonzero(~open_mask)
+    if n_new < 0 or n_new > len(candidates):
+        logger.warning('lagrangian: cannot open {} facilities with {} open of {} destinations'.format(
+            open_total, open_mask.sum(), n_destinations))
+        return infeasible()
+    # weighted cost of assigning each pair
+    weighted = populations[rows]*od['cost']
+    # a facility set leaving origins without an open pair scores penalty for each, more than any set
+    # serving every origin, so the upper bound stays finite and the steps move towards serving them
+    penalty = np.maximum.reduceat(weighted, od['indptr'][:-1]).sum() + 1
+
+    # start from each origin's cheapest assignment, the multipliers of the relaxation with every facility open
+    lam = np.minimum.reduceat(weighted, od['indptr'][:-1])
+    theta, stalled = 2.0, 0
+    lower_bound, upper_bound, best_open = -np.inf, np.inf, None
+    logger.info('lagrangian relaxation of {} pairs'.format(len(rows)))
+    for iteration in range(max_iter):
+        # subproblem: open the destinations with the most negative reduced cost
+        reduced = np.minimum(weighted - lam[rows], 0)
+        rho = np.bincount(cols, weights=reduced, minlength=n_destinations)
+        x = open_mask.copy()
+        if n_new > 0:
+            x[candidates[np.argpartition(rho[candidates], n_new - 1)[:n_new]]] = True
+        bound = lam.sum() + rho[x].sum()
+        if bound > lower_bound:
+            lower_bound, stalled = bound, 0
+        else:
+            stalled += 1
+
+        # the facility set is feasible: assign every origin to its nearest open facility
+        objective = score(od, populations, x, penalty)
+        if objective < upper_bound:
+            upper_bound, best_open = objective, x
+
+        if upper_bound - lower_bound <= gap_tol*abs(upper_bound):
+            break
+        # subgradient of the relaxed assignment constraints
+        g = 1 - np.bincount(rows, weights=(reduced < 0) & x[cols], minlength=n_origins)
+        if not g.any():
+            break
+        # halve the step when the bound stops improving
+        if stalled >= 20:
+            theta, stalled = theta/2, 0
+            if theta < 1e-6:
+                break
+        lam = lam + theta*(upper_bound - bound)/(g @ g)*g
+
+    if upper_bound >= penalty:
+        # every set left some origin without a facility among its pairs, nothing to polish
+        logger.warning('lagrangian: no facility set found serves every origin after {} iterations'.format(iteration + 1))
+        return infeasible(lower_bound)
+
+    # polish the best facility set with swaps, the subproblem's sets are often poor when distances tie
+    if upper_bound - lower_bound > gap_tol*abs(upper_bound):
+        polished = heuristic.interchange(od, populations, best_open, open_mask)
+        objective = score(od, populations, polished, penalty)
+        if objective < upper_bound:
+            best_open, upper_bound = polished, objective
+
+    gap = (upper_bound - lower_bound)/abs(upper_bound) if upper_bound != 0 else 0
+    logger.info('lagrangian: lower bound {:.6g}, upper bound {:.6g}, gap {:.4%} after {} iterations'.format(
+        lower_bound, upper_bound, gap, iteration + 1))
+    return {'open': np.flatnonzero(best_open), 'lower_bound': lower_bound, 'upper_bound': upper_bound, 'gap': gap,
+            'status': 'optimal' if gap <= gap_tol else 'iteration limit'}
+
+
+def score(od, populations, x, penalty):
+    '''
+    population weighted cost of facility set x, with penalty for every origin it leaves without an open pair
+    '''
+    cost = build.nearest_cost(od, x)
+    reached = np.isfinite(cost)
+    return populations[reached] @ cost[reached] + penalty*(~reached).sum()
+
+
+def infeasible(lower_bound=-np.inf):
+    return {'open': np.zeros(0, dtype=int), 'lower_bound': lower_bound, 'upper_bound': np.inf, 'gap': None,
+            'status': 'infeasible'}
@@ -5,6 +5,13 @@ Run a single period model to optimise selection of facilities to open
 import os
 import yaml
 import optimize
+import lagrangian
+import benders
+import heuristic
+import solvers
+import aggregate
+import build
+import cache
 import import_location
 import matplotlib.pyplot as plt
 import numpy as np
@@ -21,10 +28,16 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S')
 logger = logging.getLogger(__name__)
 
+# the config run by python main.py (batch.py runs many in parallel)
 # config_filename = 'denver-set_kpcoef'
 config_filename = 'neworleans-set_kpcoef'
 # config_filename = 'neworleans-kp_linear_exact'
 # config_filename = 'neworleans-pmedian'
+# config_filename = 'neworleans-pmedian_lagrangian'
+# config_filename = 'neworleans-kp_lagrangian'
+# config_filename = 'neworleans-kp_heuristic'
+# config_filename = 'neworleans-pmedian_benders'
+# config_filename = 'neworleans-kp_benders'
 # config_filename = 'grid-set_kpcoef'
 # config_filename = 'denver-kp_linear_exact'
 # config_filename = 'grid-kp_linear_exact'
@@ -32,49 +45,62 @@ config_filename = 'neworleans-set_kpcoef'
 # config_filename = 'wilmington-kp_linear_exact'
 # config_filename = 'wilmington-pmedian'
 
-def main():
-    logger.info('running for {}'.format(config_filename))
-    # import the config file
-    with open('./config/{}.yml'.format(config_filename)) as file:
-        config = yaml.safe_load(file)
+# the kolm pollak methods whose objective is linear in e^(alpha*d[o,d]), which kp_scaling can rescale
+KP_LINEAR = ('kp_linear_exact', 'set_kpcoef', 'kp_lagrangian', 'kp_heuristic', 'kp_benders')
+
+def main(config=None):
+    '''
+    run one config (a dict as read from a yml, see batch.py to run many), ./config/config_filename.yml if none
+    '''
+    if config is None:
+        logger.info('running for {}'.format(config_filename))
+        # import the config file
+        with open('./config/{}.yml'.format(config_filename)) as file:
+            config = yaml.safe_load(file)
+
+    # optional: the result of an identical earlier run, before any import, build or solve
+    run_key = None
+    if config.get('cache') and 'sweep' not in config and 'frontier' not in config:
+        run_key = cache.key(config)
+        result = cache.load(config, run_key)
+        if result is not None:
+            print(result['facilities'])
+            return result
+        config['export'] = cache.model_path(config, run_key)
 
     # 8,11, 23,import the location data
     location = import_location.main(config)
 
+    # optional: merge origins with nearly identical distances into weighted super-origins
+    if config.get('aggregate') is not None:
+        location, _ = aggregate.aggregate(location, config['aggregate'])
+
+    # sweep over the number to open: one model, one row per solve in the results table
+    if 'sweep' in config:
+        return sweep_facility_location(config, location)
+    # set_kpcoef over a range of kolm pollak budgets: one model, the whole trade-off curve
+    if 'frontier' in config:
+        return frontier_facility_location(config, location)
+
     # optimize to identify new facilities to open
-    open_optimal = optimize_facility_location(config, location)
-    print(open_optimal)
+    result = optimize_facility_location(config, location)
+    print(result['facilities'])
 
     # plot
     if config['plot']:
         if config['location'] == 'grid':
-            plot_grid(config, open_optimal)
+            plot_grid(config, result['facilities'])
         else:
-            plot_map(config, open_optimal, location)
-    return open_optimal
+            plot_map(config, result['facilities'], location)
+    if run_key is not None:
+        cache.store(config, run_key, result)
+    return result
 
 def optimize_facility_location(config, location):
     # unpack the variables
     origins, destinations = location['origins'], location['destinations']
-    populations, distances = location['populations'], location['distances']
-    open_current = location['existing']
-
-    #below is code added to adjust the distances in the data frame to be e^(alpha*d[o,d]), which cuts down computation time significantly during optimization
-    if config['optimize'] == 'pmedian':
-        distances = location['distances']
-    else:
-        #print('debug100',distances[(371299801001000, 197412)])
-        #print('debug101',np.exp(location['alpha']*distances[(371299801001000, 197412)]))
-        #distances[(371299801001000, 197412)]=np.exp(location['alpha']*distances[(371299801001000, 197412)])
-        for key in distances.keys():
-            #distances[key] = np.exp(location['alpha']*distances[key])
-            d_key=distances[key]  
-            #for distances larger than 63, scip can not handle how big the number e^(alpha*d[o,d]) is, there are only 76 values of d[o,d] larger than 63
-            if d_key < 63: distances[key] = np.exp(location['alpha']*distances[key])
-            else: 
-                #print('key, too big',np.exp(location['alpha']*d_key))
-                distances[key]=np.exp(location['alpha']*63)
-                #print('too big!!!!',key,np.exp(location['alpha']*63))
+    populations, open_current = location['populations'], location['existing']
+    distances, pairs = prepare_distances(config, location)
 
     #added to fix error of open total     
     if config['optimize'] == 'pmedian':
@@ -85,26 +111,287 @@ def optimize_facility_location(config, location):
         open_total = len(open_current) + config['num_to_open']                                                                             
     elif config['optimize'] == 'kp_linear_exact':
         open_total = len(open_current) + config['num_to_open']
+    elif config['optimize'] in ('pmedian_lagrangian', 'kp_lagrangian'):
+        open_total = len(open_current) + config['num_to_open']
+    elif config['optimize'] in ('pmedian_heuristic', 'kp_heuristic'):
+        open_total = len(open_current) + config['num_to_open']
+    elif config['optimize'] in ('pmedian_benders', 'kp_benders'):
+        open_total = len(open_current) + config['num_to_open']
+
+    # with kp_scaling, drop the pairs no optimal solution uses to keep the coefficients in range
+    if location.get('kp_scaling') is not None:
+        pairs = bound_kp_pairs(config, location, distances, pairs, open_total if config['optimize'] != 'set_kpcoef' else None)
+
+    # optional warm start for the MIPs: the heuristic's facility set or a list of destination ids
+    start = None
+    if config.get('warm_start') == 'heuristic':
+        if config['optimize'] in ('pmedian', 'kolmpollak', 'piecewise_linear', 'kp_linear_exact'):
+            start = heuristic.heuristic(origins, destinations, populations,
+                                        distances, open_total, open_current, pairs=pairs)['open']
+    elif config.get('warm_start') is not None:
+        start = [destinations.index(d) for d in config['warm_start']]
+
+    # solver settings: a named profile, or several backend/profile entrants racing each other
+    profile = load_profile(config.get('profile'))
+    if config.get('export') is not None:
+        # write the model SCIP solves to a file (the cache sets this)
+        profile = dict(profile or {}, export=config['export'])
+    backend, race = config.get('backend', 'scip'), False
+    if config.get('race') is not None:
+        backend = [{'backend': entrant.get('backend', 'scip'), 'profile': load_profile(entrant.get('profile', config.get('profile')))}
+                   for entrant in config['race']]
+        race = True
+    # anytime: every improved incumbent of a SCIP solve is logged and written to incumbents.csv
+    anytime = stream_incumbents(config) if config.get('anytime') else False
 
     # select the optimization algorithm
     if config['optimize'] == 'pmedian':
-        open_optimal = optimize.pmedian(origins, destinations, populations,
-                                          distances, open_total, open_current)
+        result = optimize.pmedian(origins, destinations, populations,
+                                          distances, open_total, open_current, pairs=pairs,
+                                          formulation=config.get('formulation', 'assignment'), linking=config.get('linking', 'strong'), start=start,
+                                          backend=backend, profile=profile, race=race, anytime=anytime)
     elif config['optimize'] == 'kolmpollak':
-        open_optimal = optimize.kolmpollak(origins, destinations, populations,
-                                             distances, open_total, open_current, location['alpha'])
+        result = optimize.kolmpollak(origins, destinations, populations,
+                                             distances, open_total, open_current, location['alpha'], pairs=pairs,
+                                             formulation=config.get('formulation', 'nonlinear'),
+                                             tolerance=config.get('tolerance', 1e-6), linking=config.get('linking', 'strong'), start=start,
+                                             profile=profile, anytime=anytime)
     elif config['optimize'] == 'piecewise_linear':
-        open_optimal = optimize.piecewise_linear(origins, destinations, populations,
-                                             distances, open_total, open_current, location['alpha'])                                         
+        result = optimize.piecewise_linear(origins, destinations, populations,
+                                             distances, open_total, open_current, location['alpha'], pairs=pairs,
+                                             linking=config.get('linking', 'strong'), start=start,
+                                             backend=backend, profile=profile, race=race, anytime=anytime)
     elif config['optimize'] == 'kp_linear_exact':
-        open_optimal = optimize.kp_linear_exact(origins, destinations, populations,
-                                             distances, open_total, open_current, location['alpha']) 
+        result = optimize.kp_linear_exact(origins, destinations, populations,
+                                             distances, open_total, open_current, location['alpha'], pairs=pairs,
+                                             formulation=config.get('formulation', 'assignment'), linking=config.get('linking', 'strong'), start=start,
+                                             backend=backend, profile=profile, race=race, anytime=anytime)
     elif config['optimize'] == 'set_kpcoef':
-        open_optimal = optimize.set_kpcoef(origins, destinations, populations, 
-                                             distances, open_current, location['alpha'], kpcoef=349301)        
+        result = optimize.set_kpcoef(origins, destinations, populations, 
+                                             distances, open_current, location['alpha'], kpcoef=kp_budget(config.get('kpcoef', 349301), location), pairs=pairs,
+                                             linking=config.get('linking', 'strong'), start=start,
+                                             backend=backend, profile=profile, race=race, anytime=anytime)        
+    elif config['optimize'] in ('pmedian_lagrangian', 'kp_lagrangian'):
+        # lagrangian relaxation of pmedian / kp_linear_exact: facility set with a lower bound and gap
+        result = lagrangian.lagrangian(origins, destinations, populations,
+                                       distances, open_total, open_current, pairs=pairs)
+    elif config['optimize'] in ('pmedian_heuristic', 'kp_heuristic'):
+        # greedy + interchange on pmedian's distances or the kolm pollak e^(alpha*d[o,d])
+        result = heuristic.heuristic(origins, destinations, populations,
+                                     distances, open_total, open_current, pairs=pairs)
+    elif config['optimize'] in ('pmedian_benders', 'kp_benders'):
+        # benders decomposition of pmedian / kp_linear_exact: only the x variables are in the model
+        result = benders.benders(origins, destinations, populations, distances, open_total, open_current,
+                                 pairs=pairs, blocks=config.get('benders_blocks', 32), profile=profile,
+                                 anytime=anytime)
                                                                            	
-    return(open_optimal)
+    if location.get('kp_scaling') is not None:
+        result['scaling'] = location['kp_scaling']
+    return(result)
+
+
+
+def prepare_distances(config, location):
+    '''
+    the sparse pairs (if configured) and the distances the algorithm works on
+    '''
+    origins, destinations = location['origins'], location['destinations']
+    distances, open_current = location['distances'], location['existing']
+
+    # optional sparse assignment: only keep each origin's nearby destinations (before the exp transform, so radius is a distance)
+    pairs = None
+    if config.get('k_nearest') is not None or config.get('radius') is not None:
+        # the fewest facilities any solve opens, to check the kept pairs can still serve every origin
+        open_total = None
+        if 'sweep' in config:
+            open_total = len(open_current) + min(config['sweep'])
+        elif config.get('num_to_open') is not None:
+            open_total = len(open_current) + config['num_to_open']
+        pairs, dropped = optimize.sparse_pairs(origins, destinations, distances, open_current,
+                                               k_nearest=config.get('k_nearest'), radius=config.get('radius'),
+                                               open_total=open_total)
+        location['pairs_dropped'] = dropped
+
+    #below is code added to adjust the distances to be e^(alpha*d[o,d]), which cuts down computation time significantly during optimization
+    if config['optimize'] in ('pmedian', 'pmedian_lagrangian', 'pmedian_heuristic', 'pmedian_benders'):
+        return distances, pairs
+    if config.get('kp_scaling') and config['optimize'] in KP_LINEAR:
+        # e^(alpha*(d[o,d] - reference)): no cap, the budgets and results are rescaled (see record)
+        distances, location['kp_scaling'] = optimize.scale_kp_distances(distances, location['alpha'])
+    else:
+        if config.get('kp_scaling'):
+            logger.info('kp_scaling only applies to {}, capping the distances at 63'.format(', '.join(KP_LINEAR)))
+        #for distances larger than 63, scip can not handle how big the number e^(alpha*d[o,d]) is, there are only 76 values of d[o,d] larger than 63
+        alpha = location['alpha']
+        distances = build.transform(distances, lambda d: np.exp(alpha*np.minimum(d, 63)))
+
+    return distances, pairs
+
+
+def sweep_facility_location(config, location):
+    '''
+    solve for every number to open in config['sweep'] with a single built model, only changing
+    the number of facilities and warm starting from the previous optimum in between
+    '''
+    origins, destinations = location['origins'], location['destinations']
+    populations, open_current = location['populations'], location['existing']
+    distances, pairs = prepare_distances(config, location)
+    open_totals = [len(open_current) + n for n in config['sweep']]
+    if location.get('kp_scaling') is not None:
+        # the fewest facilities has the largest optimum, a bound for all of them
+        pairs = bound_kp_pairs(config, location, distances, pairs, min(open_totals))
+
+    start = time.time()
+    if config['optimize'] == 'pmedian':
+        model = optimize.pmedian_model(origins, destinations, populations, distances, min(open_totals),
+                                       open_current, pairs=pairs, formulation=config.get('formulation', 'assignment'),
+                                       linking=config.get('linking', 'strong'))
+    elif config['optimize'] == 'kolmpollak':
+        model = optimize.kolmpollak_model(origins, destinations, populations, distances, min(open_totals),
+                                          open_current, location['alpha'], pairs=pairs,
+                                          formulation=config.get('formulation', 'nonlinear'),
+                                          tolerance=config.get('tolerance', 1e-6), linking=config.get('linking', 'strong'))
+    elif config['optimize'] == 'piecewise_linear':
+        model = optimize.piecewise_linear_model(origins, destinations, populations, distances, min(open_totals),
+                                                open_current, location['alpha'], pairs=pairs, linking=config.get('linking', 'strong'))
+    elif config['optimize'] == 'kp_linear_exact':
+        model = optimize.kp_linear_exact_model(origins, destinations, populations, distances, min(open_totals),
+                                               open_current, location['alpha'], pairs=pairs,
+                                               formulation=config.get('formulation', 'assignment'), linking=config.get('linking', 'strong'))
+    else:
+        raise ValueError('sweep only supports pmedian, kolmpollak, piecewise_linear and kp_linear_exact, not {}'.format(
+            config['optimize']))
+    solvers.apply_profile(model, load_profile(config.get('profile')))
+    build_time = time.time() - start
+    logger.info('model built in {:.1f}s'.format(build_time))
+
+    # the first row also carries the build time, in its computational time and build time
+    solutions = {}
+    for open_total, result in optimize.sweep(model, open_totals, build_time):
+        elapsed = time.time() - start
+        if location.get('kp_scaling') is not None:
+            result['scaling'] = location['kp_scaling']
+        record(config, open_total - len(open_current), elapsed, result)
+        solutions[open_total - len(open_current)] = result
+        start = time.time()
+    return solutions
+
 
+def frontier_facility_location(config, location):
+    '''
+    the fewest facilities for every kolm pollak budget in config['frontier'] = [lower, upper],
+    solving set_kpcoef with one built model, written to kp_frontier.csv
+    '''
+    origins, destinations = location['origins'], location['destinations']
+    populations, open_current = location['populations'], location['existing']
+    distances, pairs = prepare_distances(config, location)
+    lower, upper = kp_budget(config['frontier'][0], location), kp_budget(config['frontier'][1], location)
+    if location.get('kp_scaling') is not None:
+        pairs = bound_kp_pairs(config, location, distances, pairs)
+
+    start = time.time()
+    model = optimize.set_kpcoef_model(origins, destinations, populations, distances, open_current,
+                                      location['alpha'], upper, pairs=pairs, linking=config.get('linking', 'strong'))
+    solvers.apply_profile(model, load_profile(config.get('profile')))
+
+    # each breakpoint: the number of facilities needed for budgets from its kolm pollak value up to budget,
+    # written as soon as it is solved (the first row also carries the build time). a solve stopped before
+    # optimality ends the curve with a row of its budget and status
+    location_name = config['location']
+    if location_name=='grid':
+        location_name = 'grid_' + str(config['grid_size'])
+    # back to unscaled kolm pollak values if kp_scaling is on
+    factor = location['kp_scaling']['factor'] if location.get('kp_scaling') is not None else 1
+    output_path = 'kp_frontier.csv'
+    rows = []
+    for point in optimize.frontier(model, upper, lower):
+        solved = point['facilities'] is not None
+        add = pd.DataFrame([[location_name, point['kolmpollak']*factor if solved else None, point['budget']*factor,
+                             point['facilities'] - len(open_current) if solved else None,
+                             [destinations[d] for d in point['open']], time.time() - start, point['status']]],
+                           columns=['location', 'kp from', 'kp to', 'number to open', 'optimal stores',
+                                    'computational time', 'status'])
+        add.to_csv(output_path, mode='a', header=not os.path.exists(output_path))
+        rows.append(add)
+        start = time.time()
+    frontier = pd.concat(rows, ignore_index=True) if rows else pd.DataFrame()
+    logger.info('frontier of {} breakpoints'.format(sum(row['status'].iloc[0] == 'optimal' for row in rows)))
+    return frontier
+
+
+def kp_budget(kpcoef, location):
+    '''
+    a kolm pollak budget in the units the distances were transformed to (see optimize.scale_kp_distances)
+    '''
+    if location.get('kp_scaling') is None:
+        return kpcoef
+    return kpcoef/location['kp_scaling']['factor']
+
+
+def bound_kp_pairs(config, location, distances, pairs, open_total=None):
+    '''
+    the pairs whose scaled kolm pollak cost alone stays within a bound on the optimum: the budget for
+    set_kpcoef (the largest one for a frontier), the heuristic's objective otherwise
+    '''
+    origins, destinations = location['origins'], location['destinations']
+    populations, open_current = location['populations'], location['existing']
+    if 'frontier' in config:
+        bound = kp_budget(config['frontier'][1], location)
+    elif config['optimize'] == 'set_kpcoef':
+        bound = kp_budget(config.get('kpcoef', 349301), location)
+    else:
+        bound = heuristic.heuristic(origins, destinations, populations, distances, open_total, open_current,
+                                    pairs=pairs)['objective']
+    pairs, dropped = optimize.bound_pairs(origins, destinations, populations, distances, bound, pairs)
+    location['pairs_dropped'] = location.get('pairs_dropped', 0) + dropped
+    return pairs
+
+
+def load_profile(name):
+    '''
+    a named solver profile from config/solver_profiles.yml, None for no profile
+    '''
+    if name is None:
+        return None
+    with open('./config/solver_profiles.yml') as file:
+        return yaml.safe_load(file)[name]
+
+
+def stream_incumbents(config):
+    '''
+    callback for the anytime mode, appending every improved incumbent to incumbents.csv so a run
+    cut off early still leaves its best answer and shows how the gap closed
+    '''
+    location = config['location']
+    if location=='grid':
+        location = 'grid_' + str(config['grid_size'])
+    output_path = 'incumbents.csv'
+
+    def write(incumbent):
+        add = pd.DataFrame([[location, config['optimize'], config.get('num_to_open'), incumbent['time'],
+                             incumbent['objective'], incumbent['bound'], incumbent['gap'], incumbent['facilities']]],
+                           columns=['location', 'algorithm', 'number to open', 'time', 'objective', 'bound', 'gap',
+                                    'stores'])
+        add.to_csv(output_path, mode='a', header=not os.path.exists(output_path))
+    return write
+
+
+def record(config, num_to_open, elapsed, result):
+    '''
+    append a run and its result (see solvers.result) to the results table, config['results'] or
+    computation_time.csv. with kp_scaling the objective and bound are the scaled ones, and kp scaling
+    is the factor back to unscaled values
+    '''
+    location = config['location']
+    if location=='grid':
+        location = 'grid_' + str(config['grid_size'])
+    add = pd.DataFrame([[location, config['optimize'], num_to_open, elapsed, result['facilities'],
+                         result['objective'], result['bound'], result['gap'], result['nodes'], result['status'],
+                         result['build_time'], result['solve_time'], result.get('scaling', {}).get('factor')]], columns=[
+                       'location', 'algorithm', 'number to open', 'computational time', 'optimal stores',
+                       'objective', 'bound', 'gap', 'nodes', 'status', 'build time', 'solve time', 'kp scaling'])
+    output_path = config.get('results', 'computation_time.csv')
+    add.to_csv(output_path, mode='a', header=not os.path.exists(output_path))
 
 
 def plot_grid(config, open_optimal):
@@ -141,7 +428,7 @@ def plot_map(config, open_optimal, location):
     gdf['origin'] = gdf['STATEFP10'] + gdf['COUNTYFP10'] + gdf['TRACTCE10'] + gdf['BLOCKCE10']
     gdf['origin'] = gdf['origin'].astype('int64')
     # match with origins
-    populations = pd.DataFrame.from_dict(location['populations'], orient='index',columns=['population'])
+    populations = pd.DataFrame({'population': location['populations']}, index=location['origins'])
     gdf = gdf.merge(populations, how='right', left_on='origin', right_index=True)
     citymap = gdf.plot(color='white', edgecolor='black')
     xlim = citymap.get_xlim()
@@ -167,14 +454,10 @@ def plot_map(config, open_optimal, location):
 
 if __name__ == '__main__':
     start = time.time()
-    open_optimal=main()
+    result=main()
     elapsed = time.time() - start
     with open('./config/{}.yml'.format(config_filename)) as file:
         config = yaml.safe_load(file)
-    location = config['location']
-    if location=='grid':
-        location = 'grid_' + str(config['grid_size'])
-    add = pd.DataFrame([[location, config['optimize'], config['num_to_open'], elapsed,open_optimal]], columns=[
-                       'location', 'algorithm', 'number to open', 'computational time', 'optimal stores'])
-    output_path = 'computation_time.csv'
-    add.to_csv(output_path, mode='a', header=not os.path.exists(output_path))
+    # a sweep has already recorded each of its solves, a frontier has its own table
+    if 'sweep' not in config and 'frontier' not in config:
+        record(config, config['num_to_open'], elapsed, result)
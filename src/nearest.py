@@ -0,0 +1,166 @@
+'''
+Incrementally maintained nearest and second nearest open facility of every origin, for what-if
+questions on a facility set: the change in the objective of opening, closing or swapping a facility,
+and applying the move, without recomputing every origin
+
+the objective is sum_o populations[o]*cost[o, nearest open facility] on the pair arrays of
+build.pair_arrays: the distances for p median, e^(alpha*d[o,d]) for the linear kolm pollak (see
+build.transform). opening d only touches the origins with a pair to d, closing d only the origins whose
+nearest or second nearest it was (their two nearest are recomputed from their pairs). an origin without
+an open facility costs build.unassigned_cost.
+
+heuristic.interchange keeps its facility set in one through the swaps; what-if tools price single
+moves with the delta_* methods and apply the chosen one
+'''
+
+# import libraries
+import numpy as np
+import build
+import logging
+logging.basicConfig(
+    format='%(asctime)s %(levelname)-8s %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def index(location, distances=None, pairs=None, open_current=None):
+    '''
+    the index of a location (see import_location) with open_current (ids, location['existing'] if None)
+    open, on distances (location['distances'] if None) and the sparse pairs if given. every pair is kept,
+    so any facility can be closed
+    '''
+    distances = location['distances'] if distances is None else distances
+    open_current = location['existing'] if open_current is None else open_current
+    arrays = build.location_arrays(location['origins'], location['destinations'], location['populations'],
+                                   distances, open_current, pairs)
+    return NearestIndex(build.pair_arrays(arrays['cost']), arrays['populations'], arrays['open'])
+
+
+class NearestIndex:
+    '''
+    for every origin its nearest and second nearest open facility (positions in destinations, -1 for
+    none) and their costs, with the objective. facilities are positions in destinations
+    '''
+
+    def __init__(self, od, populations, x):
+        self.od = od
+        self.populations = np.asarray(populations, dtype=float)
+        self.x = np.asarray(x, dtype=bool).copy()
+        self.big = build.unassigned_cost(od)
+        # the pairs of destination d are by_destination[dptr[d]:dptr[d+1]]
+        self.by_destination = np.argsort(od['cols'], kind='stable')
+        self.dptr = np.concatenate([[0], np.cumsum(np.bincount(od['cols'], minlength=len(self.x)))])
+
+        n = len(od['indptr']) - 1
+        self.nearest, self.second = np.full(n, -1), np.full(n, -1)
+        self.first_cost, self.second_cost = np.full(n, self.big), np.full(n, self.big)
+        self.recompute(np.arange(n))
+        self.objective = float(self.populations @ self.first_cost)
+
+    def pairs_of(self, d):
+        '''
+        the origins with a pair to destination d and its cost for them
+        '''
+        pairs = self.by_destination[self.dptr[d]:self.dptr[d + 1]]
+        return self.od['rows'][pairs], self.od['cost'][pairs]
+
+    def recompute(self, origins):
+        '''
+        the two nearest open facilities of origins, from all of their pairs
+        '''
+        indptr, cols = self.od['indptr'], self.od['cols']
+        start, length = indptr[origins], indptr[origins + 1] - indptr[origins]
+        segment_start = np.cumsum(length) - length
+        pairs = np.repeat(start - segment_start, length) + np.arange(length.sum())
+        masked = np.where(self.x[cols[pairs]], self.od['cost'][pairs], np.inf)
+        # sort every origin's pairs by cost, the segments stay at segment_start
+        order = np.lexsort((masked, np.repeat(np.arange(len(origins)), length)))
+
+        for rank, facility, cost in ((0, self.nearest, self.first_cost), (1, self.second, self.second_cost)):
+            has = length > rank
+            found = order[segment_start[has] + rank]
+            value = np.full(len(origins), np.inf)
+            value[has] = masked[found]
+            position = np.full(len(origins), -1)
+            position[has] = cols[pairs[found]]
+            facility[origins] = np.where(np.isfinite(value), position, -1)
+            cost[origins] = np.minimum(value, self.big)
+
+    def delta_add(self, d):
+        '''
+        change in the objective of opening d
+        '''
+        if self.x[d]:
+            return 0.0
+        rows, cost = self.pairs_of(d)
+        return -float(self.populations[rows] @ np.maximum(self.first_cost[rows] - cost, 0))
+
+    def delta_remove(self, d):
+        '''
+        change in the objective of closing d: its origins fall back to their second nearest
+        '''
+        if not self.x[d]:
+            return 0.0
+        rows, _ = self.pairs_of(d)
+        served = rows[self.nearest[rows] == d]
+        return float(self.populations[served] @ (self.second_cost[served] - self.first_cost[served]))
+
+    def delta_swap(self, d_in, d_out):
+        '''
+        change in the objective of opening d_in and closing d_out, over the origins with a pair to either
+        '''
+        if d_in == d_out:
+            return 0.0
+        if self.x[d_in] or not self.x[d_out]:
+            return self.delta_add(d_in) + self.delta_remove(d_out)
+        rows_in, cost_in = self.pairs_of(d_in)
+        rows_out, _ = self.pairs_of(d_out)
+        affected = np.union1d(rows_in, rows_out)
+        fallback = np.where(self.nearest[affected] == d_out, self.second_cost[affected], self.first_cost[affected])
+        to_in = np.full(len(affected), np.inf)
+        to_in[np.searchsorted(affected, rows_in)] = cost_in
+        new = np.minimum(fallback, to_in)
+        return float(self.populations[affected] @ (new - self.first_cost[affected]))
+
+    def add(self, d):
+        '''
+        open d, returns the change in the objective
+        '''
+        if self.x[d]:
+            return 0.0
+        rows, cost = self.pairs_of(d)
+        self.x[d] = True
+        old = self.first_cost[rows].copy()
+        closer = cost < self.first_cost[rows]
+        between = ~closer & (cost < self.second_cost[rows])
+        moved = rows[closer]
+        self.second[moved], self.second_cost[moved] = self.nearest[moved], self.first_cost[moved]
+        self.nearest[moved], self.first_cost[moved] = d, cost[closer]
+        self.second[rows[between]], self.second_cost[rows[between]] = d, cost[between]
+        delta = float(self.populations[rows] @ (self.first_cost[rows] - old))
+        self.objective += delta
+        return delta
+
+    def remove(self, d):
+        '''
+        close d, returns the change in the objective
+        '''
+        if not self.x[d]:
+            return 0.0
+        rows, _ = self.pairs_of(d)
+        self.x[d] = False
+        affected = rows[(self.nearest[rows] == d) | (self.second[rows] == d)]
+        old = self.first_cost[affected].copy()
+        self.recompute(affected)
+        delta = float(self.populations[affected] @ (self.first_cost[affected] - old))
+        self.objective += delta
+        return delta
+
+    def swap(self, d_in, d_out):
+        '''
+        open d_in and close d_out, returns the change in the objective
+        '''
+        if d_in == d_out:
+            return 0.0
+        return self.add(d_in) + self.remove(d_out)
@@ -1,17 +1,31 @@
 '''
 This script contains the different optimisation functions
-- kolmpollak
+- kolmpollak (nonlinear, or an outer approximation by lazy tangents, see outer.py)
 - p median
 - piecewise linear
 - kolm pollak exact linearisation
 - kolm pollak minimize number of stores
+- radius (closest assignment) formulation for the linear objectives
+
+the linear ones are built as programs (see build.py) that SCIP or HiGHS solves (see solvers.py),
+the *_model functions give the SCIP model of a program for sweep and frontier
+the assignment formulations take linking='lazy' to leave the y <= x rows to a SCIP separator (see build.add_assignment)
 '''
 
 # import libraries
-from pyscipopt import Model, quicksum, multidict, exp
+try:
+    from pyscipopt import quicksum, exp
+except ImportError:
+    # only kolmpollak and the SCIP backend need pyscipopt, the highs backend runs without it
+    quicksum = exp = None
 import numpy as np
-import itertools
-import math
+import build
+import heuristic
+import solvers
+import outer
+import time
+import multiprocessing
+from queue import Empty
 import logging
 logging.basicConfig(
     format='%(asctime)s %(levelname)-8s %(message)s',
@@ -20,238 +34,538 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def set_kpcoef(origins, destinations, populations, distances, open_current, alpha, kpcoef): # 0 is kpcoef
-    model = Model()
-    logger.info('set variables')
-    # x_d is binary, 1 if destination d is opened, 0 otherwise
-    x = {d: model.addVar(vtype="B") for d in destinations}
-    # y_o,d is binary, 1 if destination d is assigned to origin o, 0 otherwise
-    y = {i: model.addVar(vtype="B") for i in itertools.product(origins, destinations)}
+def sparse_pairs(origins, destinations, distances, open_current, k_nearest=None, radius=None, open_total=None):
+    '''
+    keep, for each origin, only its k nearest destinations and/or those within radius,
+    plus its nearest already-open facility so the origin always has somewhere to go.
+    destinations further away than the nearest open facility are always dropped: open_current
+    stays open, so the origin would never be assigned to them anyway.
+    without open facilities nothing guarantees that open_total facilities can serve every origin
+    through the kept pairs (see check_cover).
+    distances must be untransformed for radius to be in the units of the data.
+    returns the kept destinations of each origin (ids) and how many pairs were dropped
+    '''
+    index = {d: j for j, d in enumerate(destinations)}
+    open_mask = np.zeros(len(destinations), dtype=bool)
+    open_mask[[index[d] for d in open_current]] = True
+    pairs = {}
+    dropped = 0
+    for i, o in enumerate(origins):
+        cols, values = build.row_pairs(distances, i)
+        order = np.argsort(values, kind='stable')
+        ranked, values = cols[order], values[order]
+        keep = np.ones(len(ranked), dtype=bool)
+        if k_nearest is not None:
+            keep[k_nearest:] = False
+        if radius is not None:
+            keep &= values <= radius
+        # the nearest open facility bounds how far the origin will ever travel
+        is_open = open_mask[ranked]
+        if is_open.any():
+            nearest_open = np.argmax(is_open)
+            keep &= values <= values[nearest_open]
+            keep[nearest_open] = True
+        elif not keep.any():
+            # nothing within the radius and nothing open, fall back to the nearest destination
+            keep[:1] = True
+        pairs[o] = [destinations[j] for j in ranked[keep].tolist()]
+        dropped += len(destinations) - len(pairs[o])
+
+    logger.info('sparse assignment: dropped {} of {} origin-destination pairs'.format(
+        dropped, len(origins)*len(destinations)))
+    if len(open_current) == 0:
+        logger.warning('sparse assignment: no open facilities, so nothing guarantees every origin can be served')
+        if open_total is not None:
+            check_cover(origins, destinations, pairs, open_total)
+    return(pairs, dropped)
+
+
+def check_cover(origins, destinations, pairs, open_total):
+    '''
+    whether open_total facilities can serve every origin through its kept pairs, by a greedy set cover
+    (opening the destination kept by the most unserved origins). if greedy needs more facilities the
+    model may be infeasible, which is warned about
+    '''
+    index = {d: j for j, d in enumerate(destinations)}
+    rows = np.repeat(np.arange(len(origins)), [len(pairs[o]) for o in origins])
+    cols = np.array([index[d] for o in origins for d in pairs[o]], dtype=int)
+    served = np.zeros(len(origins), dtype=bool)
+    opened = 0
+    while not served.all() and opened < open_total:
+        unserved = ~served[rows]
+        d = np.argmax(np.bincount(cols[unserved], minlength=len(destinations)))
+        served[rows[cols == d]] = True
+        opened += 1
+    if not served.all():
+        logger.warning(('sparse assignment: {} facilities leave {} origins without a kept destination in a greedy '
+                        'cover, the model may be infeasible: increase k_nearest or radius').format(
+                            open_total, (~served).sum()))
+    return bool(served.all())
+
+
+def scale_kp_distances(distances, alpha):
+    '''
+    e^(alpha*(d[o,d] - reference)) for every distance, for the kolm pollak methods that are linear in
+    e^(alpha*d[o,d]): the objective and the budget are e^(-alpha*reference) times the unscaled
+    ones and the optimal facilities are the same, without capping any distance. the reference is the
+    distance of the origin furthest from its nearest destination, which every solution has to cover,
+    so the objective of any solution is at least that origin's population.
+    returns the scaled distances and the scaling: the reference distance and the factor
+    e^(alpha*reference) back to unscaled values
+    '''
+    nearest = build.nearest_distance(distances)
+    reference = float(nearest[np.isfinite(nearest)].max())
+    distances = build.transform(distances, lambda d: np.exp(alpha*(d - reference)))
+
+    scaling = {'reference': reference, 'factor': np.exp(alpha*reference)}
+    logger.info('kolm pollak scaling: e^(alpha*(d - {:.6g})), unscaled values are {:.6g} times the scaled ones'.format(
+        reference, scaling['factor']))
+    return(distances, scaling)
+
+
+def bound_pairs(origins, destinations, populations, distances, bound, pairs=None):
+    '''
+    keep, for each origin, only the destinations with populations[o]*distances[o,d] <= bound (plus its
+    nearest one). with the objective of a known solution, or a kolm pollak budget, as the bound no optimal
+    solution assigns any of the dropped pairs, so the optimum is unchanged
+    '''
+    index = {d: j for j, d in enumerate(destinations)}
+    kept = {}
+    dropped, largest = 0, 0
+    for i, o in enumerate(origins):
+        if pairs is not None:
+            cols = np.array([index[d] for d in pairs[o]], dtype=int)
+            values = np.asarray(distances[np.full(len(cols), i), cols], dtype=float).ravel()
+        else:
+            cols, values = build.row_pairs(distances, i)
+        cost = populations[i]*values
+        keep = cost <= bound*(1 + 1e-9)
+        if not keep.any():
+            keep[np.argmin(values)] = True
+        kept[o] = [destinations[j] for j in cols[keep].tolist()]
+        dropped += len(cols) - keep.sum()
+        largest = max(largest, cost[keep].max())
+
+    logger.info('bounded assignment: dropped {} pairs costing more than {:.6g} on their own, largest kept {:.3g}'.format(
+        dropped, bound, largest))
+    return(kept, int(dropped))
+
+
+def set_kpcoef(origins, destinations, populations, distances, open_current, alpha, kpcoef, pairs=None, linking='strong', start=None, backend='scip', profile=None, race=False, anytime=False): # 0 is kpcoef
+    begin = time.time()
+    program = set_kpcoef_program(origins, destinations, populations, distances, open_current, alpha, kpcoef, pairs, linking)
+    result = solve_program(program, backend, start, profile, race, anytime, time.time() - begin)
+######## new print statement
+    print(result['facilities'])
+    return(result)
+
+
+def set_kpcoef_model(origins, destinations, populations, distances, open_current, alpha, kpcoef, pairs=None, linking='strong'):
+    return(solvers.scip_model(set_kpcoef_program(origins, destinations, populations, distances, open_current, alpha, kpcoef, pairs, linking)))
+
+
+def set_kpcoef_program(origins, destinations, populations, distances, open_current, alpha, kpcoef, pairs=None, linking='strong'):
+    arrays = build.location_arrays(origins, destinations, populations, distances, open_current, pairs)
+    od = build.pair_arrays(arrays['cost'], arrays['open'])
+    program = build.facility_program(arrays)
+    y = build.add_assignment(program, od, linking=linking)
 
-    logger.info('set constraints')
-    # constraint: each origin can only be assigned a single destination
-    for o in origins:
-        model.addCons(quicksum(y[o, d] for d in destinations) == 1)
-    
-    # constraint: an origin cannot be assigned an unopen destination
-    for d in destinations:
-        for o in origins:
-            model.addCons(y[o, d]-x[d] <= 0)
-
-    # constraint: which destinations are already open
-    for d in open_current:
-        model.addCons(x[d] == 1)
-        
     # Kolm-Pollak Constraint
-    model.addCons(quicksum(populations[o]*y[o,d]*distances[o,d]
-                           for d in destinations for o in origins) - kpcoef <= 0)
-    
+    coef = arrays['populations'][od['rows']]*od['cost']
+    program['budget_coef'] = coef
+    program['budget'] = build.add_rows(program, np.zeros(len(y), dtype=int), y, coef, upper=kpcoef)[0]
+
     # NEW objective: minimize the number of destinations
     logger.info('set objective')
-    model.setObjective(quicksum(x[d] for d in destinations), 'minimize')   
-    
-    # solve the model
-    logger.info('optimizing')
-    model.optimize()
+    program['obj'][program['x']] = 1
+    return(program)
 
-    # identify which facilities are opened (i.e., their value = 1)
-    new_facilities = np.where([int(round(model.getVal(x[d]))) for d in destinations])[0]
-    
-######## new print statement
-    print(new_facilities)
-    return(new_facilities) # no longer returning list of facilities????
 
+def kolmpollak(origins, destinations, populations, distances, open_total, open_current, alpha, pairs=None, formulation='nonlinear', tolerance=1e-6, linking='strong', start=None, profile=None, anytime=False):
+    begin = time.time()
+    model = kolmpollak_model(origins, destinations, populations, distances, open_total, open_current, alpha, pairs, formulation, tolerance, linking)
+    solution = solve(solvers.apply_profile(model, profile), start, anytime, time.time() - begin)
+    if model.data.get('tangents') is not None:
+        solution['cuts'] = model.data['tangents'].n_cuts
+        logger.info('outer approximation: {} tangents added'.format(solution['cuts']))
+    return(solution)
 
-def kolmpollak(origins, destinations, populations, distances, open_total, open_current, alpha):
-    model = Model()
-    logger.info('set variables')
-    # x_d is binary, 1 if destination d is opened, 0 otherwise
-    x = {d: model.addVar(vtype="B") for d in destinations}
-    # y_o,d is binary, 1 if destination d is assigned to origin o, 0 otherwise
-    y = {i: model.addVar(vtype="B") for i in itertools.product(origins, destinations)}
 
-    logger.info('set constraints')
-    # constraint: each origin can only be assigned a single destination
-    for o in origins:
-        model.addCons(quicksum(y[o, d] for d in destinations) == 1)
-    
-    # constraint: an origin cannot be assigned an unopen destination
-    for d in destinations:
-        for o in origins:
-            model.addCons(y[o, d]-x[d] <= 0)
-
-    # constraint: the sum of open destinations should equal the number we want to be open
-    model.addCons(quicksum(x[d] for d in destinations) == open_total)
-
-    # constraint: which destinations are already open
-    for d in open_current:
-        model.addCons(x[d] == 1)  
+def kolmpollak_model(origins, destinations, populations, distances, open_total, open_current, alpha, pairs=None, formulation='nonlinear', tolerance=1e-6, linking='strong'):
+    if formulation == 'outer':
+        return(kolmpollak_outer_model(origins, destinations, populations, distances, open_total, open_current, alpha, pairs, tolerance, linking))
+    arrays = build.location_arrays(origins, destinations, populations, distances, open_current, pairs)
+    od = build.pair_arrays(arrays['cost'], arrays['open'])
+    program = build.facility_program(arrays, open_total)
+    build.add_assignment(program, od, linking=linking)
+    # the objective is nonlinear, so only SCIP
+    model = solvers.scip_model(program)
+    y = model.data['y']
+
     # formulating the Kolm-Pollak EDE
-    z = {}
-    # z = {o: model.addVar(vtype="C", name="z(%s)" % (o)) for o in origins}
-    w = {o: model.addVar(vtype="C", name="w(%s)" % (o)) for o in origins}
-    for o in origins:
+    indptr = od['indptr'].tolist()
+    cost = od['cost'].tolist()
+    w = [model.addVar(vtype="C", name="w(%s)" % (o), obj=1) for o in origins]
+    for i, (begin, end) in enumerate(zip(indptr[:-1], indptr[1:])):
         # evaluate the EDE
-        z[o] = quicksum(distances[o, d]*y[o, d] for d in destinations)
-        exp_power = alpha*z[o]
-        model.addCons((w[o] -populations[o]*exp(exp_power)) == 0)
+        z = quicksum(c*y_od for c, y_od in zip(cost[begin:end], y[begin:end]))
+        model.addCons((w[i] - arrays['populations'][i]*exp(alpha*z)) == 0)
+    return(model)
 
-    # objective: minimise the kolmpollak EDE
-    logger.info('set objective')
-    model.setObjective(quicksum(w[o] for o in origins), 'minimize')
 
-    # solve the model
-    logger.info('optimizing')
-    model.optimize()
+def kolmpollak_outer_model(origins, destinations, populations, distances, open_total, open_current, alpha, pairs=None, tolerance=1e-6, linking='strong'):
+    '''
+    the kolm pollak model as an outer approximation (see outer.py): linear, starting from tangents
+    at each origin's nearest, middle and farthest distance, and exact within tolerance once solved
+    '''
+    arrays = build.location_arrays(origins, destinations, populations, distances, open_current, pairs)
+    od = build.pair_arrays(arrays['cost'], arrays['open'])
+    program = build.facility_program(arrays, open_total)
+    y = build.add_assignment(program, od, linking=linking)
+    w = build.add_columns(program, np.ones(len(origins)), ub=np.inf)
+    program['w'] = w
+    nearest = np.minimum.reduceat(od['cost'], od['indptr'][:-1])
+    farthest = np.maximum.reduceat(od['cost'], od['indptr'][:-1])
+    add_tangents(program, od, w, y, arrays['populations'], alpha,
+                 np.stack([nearest, (nearest + farthest)/2, farthest], axis=1))
+    model = solvers.scip_model(program)
+    outer.add_tangent_cuts(model, od, arrays['populations'], alpha, tolerance)
+    return(model)
 
-    # identify which facilities are opened (i.e., their value = 1)
-    new_facilities = np.where([int(round(model.getVal(x[d]))) for d in destinations])[0]
-    
-    return(new_facilities)
-    
-def piecewise_linear(origins, destinations, populations, distances, open_total, open_current, alpha):
-    model = Model()
-    logger.info('set variables')
-    # x_d is binary, 1 if destination d is opened, 0 otherwise
-    x = {d: model.addVar(vtype="B") for d in destinations}
-    # y_o,d is binary, 1 if destination d is assigned to origin o, 0 otherwise
-    y = {i: model.addVar(vtype="B") for i in itertools.product(origins, destinations)}
-    
 
-    logger.info('set constraints')
-    # constraint: each origin can only be assigned a single destination
-    for o in origins:
-        model.addCons(quicksum(y[o, d] for d in destinations) == 1)
-    
-    # constraint: an origin cannot be assigned an unopen destination
-    for d in destinations:
-        for o in origins:
-            model.addCons(y[o, d]-x[d] <= 0)
-
-    # constraint: the sum of open destinations should equal the number we want to be open
-    model.addCons(quicksum(x[d] for d in destinations) == open_total)
-
-    # constraint: which destinations are already open
-    for d in open_current:
-        model.addCons(x[d] == 1)
-  
+def piecewise_linear(origins, destinations, populations, distances, open_total, open_current, alpha, pairs=None, linking='strong', start=None, backend='scip', profile=None, race=False, anytime=False):
+    begin = time.time()
+    program = piecewise_linear_program(origins, destinations, populations, distances, open_total, open_current, alpha, pairs, linking)
+    return(solve_program(program, backend, start, profile, race, anytime, time.time() - begin))
+
+
+def piecewise_linear_model(origins, destinations, populations, distances, open_total, open_current, alpha, pairs=None, linking='strong'):
+    return(solvers.scip_model(piecewise_linear_program(origins, destinations, populations, distances, open_total, open_current, alpha, pairs, linking)))
+
+
+def piecewise_linear_program(origins, destinations, populations, distances, open_total, open_current, alpha, pairs=None, linking='strong'):
+    arrays = build.location_arrays(origins, destinations, populations, distances, open_current, pairs)
+    od = build.pair_arrays(arrays['cost'], arrays['open'])
+    program = build.facility_program(arrays, open_total)
+    y = build.add_assignment(program, od, linking=linking)
+
     # formulating the piecewise linear relaxation
+    #b_o is the max value x_o can take, for linearization (over all of the origin's destinations)
+    full = build.pair_arrays(arrays['cost'])
+    b = np.maximum.reduceat(full['cost'], full['indptr'][:-1])
+    w = build.add_columns(program, np.ones(len(origins)), ub=np.inf)
+    # tangents to e^(alpha*z) at 0, b/2, 2b/3 and b
+    fractions = np.array([0, 1/2, 2/3, 1])
+    add_tangents(program, od, w, y, arrays['populations'], alpha, b[:, None]*fractions[None, :])
+    return(program)
 
-    z, b = {}, {}
-    w = {o: model.addVar(vtype="C", name="w(%s)" % (o)) for o in origins}
-    for o in origins:
-        # evaluate the EDE
-        z[o] = quicksum(distances[o, d]*y[o, d] for d in destinations)
-        #b_o is the max value x_o can take, for linearization
-        b[o] = max(distances[o,d] for d in destinations)
-        model.addCons(w[o]-populations[o]*(alpha*z[o]+1) >= 0)
-       	model.addCons(w[o]-populations[o]*exp(alpha*b[o]/2)*(alpha*z[o]-alpha*b[o]/2+1) >=0)
-        model.addCons(w[o]-populations[o]*exp(alpha*2*b[o]/3)*(alpha*z[o]-alpha*2*b[o]/3+1) >=0)
-        model.addCons(w[o]-populations[o]*exp(alpha*b[o])*(alpha*z[o]-alpha*b[o]+1) >= 0)
-
-    # objective: minimise the kolmpollak EDE
-    logger.info('set objective')
-    model.setObjective(quicksum(w[o] for o in origins), 'minimize')
 
-    # solve the model
-    logger.info('optimizing')
-    model.optimize()
+def add_tangents(program, od, w, y, populations, alpha, t):
+    '''
+    add tangents to populations[o]*e^(alpha*z_o) at the points t[o, :] below the w columns,
+    with z_o = sum_d cost[o,d]*y_o,d: w_o - p_o*e^(alpha*t)*alpha*z_o >= p_o*e^(alpha*t)*(1 - alpha*t),
+    one row per origin and point
+    '''
+    n_origins, n_points = t.shape
+    slope = populations[:, None]*np.exp(alpha*t)
+    n = n_origins*n_points
+    tangent = np.arange(n_points)
+    rows = np.concatenate([np.arange(n), (od['rows'][:, None]*n_points + tangent[None, :]).ravel()])
+    cols = np.concatenate([np.repeat(w, n_points), np.repeat(y, n_points)])
+    vals = np.concatenate([np.ones(n), (-alpha*slope[od['rows']]*od['cost'][:, None]).ravel()])
+    return(build.add_rows(program, rows, cols, vals, lower=(slope*(1 - alpha*t)).ravel()))
 
-    # identify which facilities are opened (i.e., their value = 1)
-    new_facilities = np.where([int(round(model.getVal(x[d]))) for d in destinations])[0]
-    
-    return(new_facilities)    
-
-def kp_linear_exact(origins, destinations, populations, distances, open_total, open_current, alpha):
-    model = Model()
-    
-    logger.info('set variables')
-    # x_d is binary, 1 if destination d is opened, 0 otherwise
-    x = {d: model.addVar(vtype="B") for d in destinations}
-    # y_o,d is binary, 1 if destination d is assigned to origin o, 0 otherwise
-    y = {i: model.addVar(vtype="B") for i in itertools.product(origins, destinations)}
-    # w_o is a variable used as shorthand in the objective function
-    # w = {o: model.addVar(vtype="C") for o in origins} # took out name="w(%s)" % (o) from this
-    
-    logger.info('set objectives')
-    
-    #formulating the exact linear objective function
-    #model.setObjective(quicksum(w[o] for o in origins), 'minimize')
-    model.setObjective(quicksum(populations[o]*y[o,d]*distances[o,d] for d in destinations for o in origins), 'minimize')    
 
-    logger.info('set constraints')
-    
-    #constraint: shorthand for the objective function
-    #for o in origins:
-        #model.addCons((w[o] -quicksum(populations[o]*y[o,d]*exp(alpha*distances[o,d]) for d in destinations)) == 0)
-    
-    # constraint: each origin can only be assigned a single destination
-    for o in origins:
-        model.addCons(quicksum(y[o,d] for d in destinations) == 1)
-    
-    # constraint: an origin cannot be assigned an unopen destination
-    for d in destinations:
-        for o in origins:
-            model.addCons(y[o,d]-x[d] <= 0)
-
-    # constraint: the sum of open destinations should equal the number we want to be open
-    model.addCons(quicksum(x[d] for d in destinations) == open_total)
-
-    # constraint: which destinations are already open
-    for d in open_current:
-        model.addCons(x[d] == 1)
+def kp_linear_exact(origins, destinations, populations, distances, open_total, open_current, alpha, pairs=None, formulation='assignment', linking='strong', start=None, backend='scip', profile=None, race=False, anytime=False):
+    begin = time.time()
+    program = kp_linear_exact_program(origins, destinations, populations, distances, open_total, open_current, alpha, pairs, formulation, linking)
+    return(solve_program(program, backend, start, profile, race, anytime, time.time() - begin))
 
-    # solve the model
-    logger.info('optimizing')
 
-    model.optimize()
-    
-    logger.info('optimization complete')
-    
-    # identify which facilities are opened (i.e., their value = 1)
-    # np.where creates a 2-dim array, and the [0] at the end pulls only the first elements of the array which are the indices of the x's
-    new_facilities = np.where([int(round(model.getVal(x[d]))) for d in destinations])[0]
-    
-    #print(model. getObjVal ())
-    return(new_facilities)
+def kp_linear_exact_model(origins, destinations, populations, distances, open_total, open_current, alpha, pairs=None, formulation='assignment', linking='strong'):
+    return(solvers.scip_model(kp_linear_exact_program(origins, destinations, populations, distances, open_total, open_current, alpha, pairs, formulation, linking)))
+
+
+def kp_linear_exact_program(origins, destinations, populations, distances, open_total, open_current, alpha, pairs=None, formulation='assignment', linking='strong'):
+    if formulation == 'radius':
+        # distances are already e^(alpha*d[o,d]) so the objective is linear in them
+        return(radius_program(origins, destinations, populations, distances, open_total, open_current, pairs))
+    arrays = build.location_arrays(origins, destinations, populations, distances, open_current, pairs)
+    od = build.pair_arrays(arrays['cost'], arrays['open'])
+    program = build.facility_program(arrays, open_total)
+    #formulating the exact linear objective function: distances are already e^(alpha*d[o,d])
+    build.add_assignment(program, od, obj=arrays['populations'][od['rows']]*od['cost'], linking=linking)
+    return(program)
+
+
+def pmedian(origins, destinations, populations, distances, open_total, open_current, pairs=None, formulation='assignment', linking='strong', start=None, backend='scip', profile=None, race=False, anytime=False):
+    begin = time.time()
+    program = pmedian_program(origins, destinations, populations, distances, open_total, open_current, pairs, formulation, linking)
+    return(solve_program(program, backend, start, profile, race, anytime, time.time() - begin))
+
+
+def pmedian_model(origins, destinations, populations, distances, open_total, open_current, pairs=None, formulation='assignment', linking='strong'):
+    return(solvers.scip_model(pmedian_program(origins, destinations, populations, distances, open_total, open_current, pairs, formulation, linking)))
 
-def pmedian(origins, destinations, populations, distances, open_total, open_current):
+
+def pmedian_program(origins, destinations, populations, distances, open_total, open_current, pairs=None, formulation='assignment', linking='strong'):
+    if formulation == 'radius':
+        return(radius_program(origins, destinations, populations, distances, open_total, open_current, pairs))
     # construct model
-    model = Model()
-    logger.info('set variables')
-    # x_d is binary, 1 if destination d is opened, 0 otherwise
-    x = {d: model.addVar(vtype="B") for d in destinations}
-    # y_o,d is binary, 1 if destination d is assigned to origin o, 0 otherwise
-    y = {i: model.addVar(vtype="B") for i in itertools.product(origins, destinations)}
-    
+    arrays = build.location_arrays(origins, destinations, populations, distances, open_current, pairs)
+    od = build.pair_arrays(arrays['cost'], arrays['open'])
+    program = build.facility_program(arrays, open_total)
     # objective: minimize the population weighted distance
-    logger.info('set objectives')
-    # tmp = distances.reset_index().merge(populations.reset_index(), how='right', on='origin').set_index(['origin','destination'])
-    # tmp['pwd'] = tmp.distance * tmp.population
-    model.setObjective(quicksum(
-            populations[o]*distances[o,d]*y[o,d] 
-                for d in destinations for o in origins), 'minimize')
-    # constraint: each origin can only be assigned a single destination
+    build.add_assignment(program, od, obj=arrays['populations'][od['rows']]*od['cost'], linking=linking)
+    return(program)
+
+
+def radius(origins, destinations, populations, distances, open_total, open_current, pairs=None, start=None, backend='scip', profile=None, race=False, anytime=False):
+    begin = time.time()
+    program = radius_program(origins, destinations, populations, distances, open_total, open_current, pairs)
+    return(solve_program(program, backend, start, profile, race, anytime, time.time() - begin))
+
+
+def radius_model(origins, destinations, populations, distances, open_total, open_current, pairs=None):
+    return(solvers.scip_model(radius_program(origins, destinations, populations, distances, open_total, open_current, pairs)))
+
+
+def radius_program(origins, destinations, populations, distances, open_total, open_current, pairs=None):
+    '''
+    compact "closest assignment" (radius) formulation of min sum_o populations[o]*distances[o, nearest open]
+    (Elloumi, 2010), used by pmedian and kp_linear_exact.
+    each origin's distinct distances are sorted into levels D_1 < ... < D_K and z_o,k = 1 if none of
+    the destinations within D_k are open, so the origin's distance is D_1 + sum_k (D_k+1 - D_k)*z_o,k.
+    every x_d appears in one constraint per origin and the z's are continuous, and levels beyond
+    the origin's nearest already-open facility are never needed.
+    '''
+    arrays = build.location_arrays(origins, destinations, populations, distances, open_current, pairs)
+    od = build.pair_arrays(arrays['cost'], arrays['open'])
+    program = build.facility_program(arrays, open_total)
+    program['pairs'] = od
+    add_radius(program, od, arrays['populations'])
+    return(program)
+
+
+def add_radius(program, od, populations):
+    '''
+    add the radius formulation's z columns, constraints and objective to a facility program
+    '''
     logger.info('set constraints')
-    for o in origins:
-        model.addCons(quicksum(y[o,d] for d in destinations) == 1)
-    
-    # constraint: an origin cannot be assigned an unopen destination
-    for d in destinations:
-        for o in origins:
-            model.addCons(y[o,d]-x[d] <= 0)
-    
-    # constraint: the sum of open destinations should equal the number we want to be open
-    model.addCons(quicksum(x[d] for d in destinations) == open_total)
-    
-    # constraint: which destinations are already open
-    for d in open_current:
-        model.addCons(x[d] == 1)
-    
+    # od has no pairs beyond the nearest open facility, so neither are there levels past it.
+    # sort every origin's pairs by distance and number the distance levels across all origins
+    order = np.lexsort((od['cost'], od['rows']))
+    rows, cols, dist = od['rows'][order], od['cols'][order], od['cost'][order]
+    first_pair = np.r_[True, rows[1:] != rows[:-1]]
+    level = np.cumsum(first_pair | np.r_[True, dist[1:] != dist[:-1]]) - 1
+    starts = np.flatnonzero(np.r_[True, level[1:] != level[:-1]])
+    radii, level_row = dist[starts], rows[starts]
+    first_level = first_pair[starts]
+    last_level = np.r_[level_row[1:] != level_row[:-1], True]
+    program['offset'] += populations[level_row[first_level]] @ radii[first_level]
+
+    # z_o,k is 1 if the origin is further than D_k from every open destination (none for the last level)
+    inner = np.flatnonzero(~last_level)
+    z = np.full(len(radii), -1)
+    z[inner] = build.add_columns(program, populations[level_row[inner]]*(radii[inner + 1] - radii[inner]))
+    # z_o,k + sum of x within D_k - z_o,k-1 >= 0 (z_o,0 = 1),
+    # and something within the last level must be open
+    later = np.flatnonzero(~first_level)
+    build.add_rows(program,
+                   np.concatenate([level, inner, later]),
+                   np.concatenate([program['x'][cols], z[inner], z[later - 1]]),
+                   np.concatenate([np.ones(len(level)), np.ones(len(inner)), -np.ones(len(later))]),
+                   lower=first_level.astype(float))
+    logger.info('radius formulation: {} distance levels for {} origins'.format(len(radii), len(od['indptr']) - 1))
+
+
+def solve_program(program, backend='scip', start=None, profile=None, race=False, anytime=False, build_time=None):
+    '''
+    solve a linear program from one of the *_program functions with the 'scip' or 'highs' backend under
+    a solver profile, and return the result (see solvers.result). backend can also be a list of
+    backends and/or {'backend', 'profile'} entries: they solve the same program one after the other
+    (see benchmark), or at the same time with race (see race_entrants). the first one's result is returned
+    '''
+    if isinstance(backend, (list, tuple)):
+        entrants = [entrant if isinstance(entrant, dict) else {'backend': entrant, 'profile': profile}
+                    for entrant in backend]
+        if race:
+            return(race_entrants(program, entrants, start, build_time))
+        return(benchmark(program, entrants, start, build_time)[0])
+    if backend == 'highs':
+        if anytime:
+            logger.info('highs: scipy.optimize.milp streams no incumbents, solving without the anytime mode')
+        return(solvers.highs(program, start, profile, build_time))
+    begin = time.time()
+    model = solvers.apply_profile(solvers.scip_model(program), profile)
+    return(solve(model, start, anytime, (build_time or 0) + time.time() - begin))
+
+
+def benchmark(program, backends=('scip', 'highs'), start=None, build_time=None):
+    '''
+    solve one built program with each backend (or {'backend', 'profile'} entry), returns the result
+    of each with its backend
+    '''
+    results = []
+    for entrant in backends:
+        if not isinstance(entrant, dict):
+            entrant = {'backend': entrant, 'profile': None}
+        result = solve_program(program, entrant['backend'], start, entrant.get('profile'), build_time=build_time)
+        logger.info('benchmark: {} solved in {:.2f}s'.format(entrant['backend'], result['solve_time']))
+        results.append(dict(result, backend=entrant['backend']))
+    return(results)
+
+
+def race_entrants(program, entrants, start=None, build_time=None):
+    '''
+    solve one built program in a process per entrant ({'backend', 'profile'}), return the result of
+    the first to prove optimality and stop the others. if none does (limits, failures), the best
+    solution found. the result also holds the winning entrant's position in entrants
+    '''
+    queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=race_entrant, args=(i, program, entrant, start, build_time, queue),
+                                         daemon=True)
+                 for i, entrant in enumerate(entrants)]
+    for process in processes:
+        process.start()
+
+    winner, best, finished = None, None, 0
+    while finished < len(processes):
+        try:
+            result = queue.get(timeout=1)
+        except Empty:
+            # an entrant that died without reporting (e.g. out of memory) never will
+            if not any(process.is_alive() for process in processes) and queue.empty():
+                break
+            continue
+        finished += 1
+        if result['objective'] is not None and (best is None or result['objective'] < best['objective']):
+            best = result
+        if result['status'] == 'optimal':
+            winner = result
+            break
+
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+    if winner is None:
+        winner = best
+    if winner is None:
+        raise RuntimeError('race: no entrant found a solution')
+    logger.info('race: {} won ({}, objective {:.6g})'.format(
+        entrants[winner['entrant']], winner['status'], winner['objective']))
+    return(winner)
+
+
+def race_entrant(i, program, entrant, start, build_time, queue):
+    '''
+    one entrant of race_entrants, reports its result on the queue
+    '''
+    try:
+        result = solve_program(program, entrant['backend'], start, entrant.get('profile'), build_time=build_time)
+    except Exception as error:
+        logger.warning('race: entrant {} failed: {}'.format(entrant, error))
+        result = solvers.result(program['destinations'], [], status='failed')
+    result['entrant'] = i
+    queue.put(result)
+
+
+def solve(model, start=None, anytime=False, build_time=None):
+    '''
+    optimize a SCIP model from one of the *_model functions, warm started from a facility set if given,
+    and return the result (see solvers.result). a profile with threads (see solvers.apply_profile)
+    runs SCIP's concurrent solvers. with anytime every improved incumbent is logged while SCIP runs,
+    and passed to anytime if it is a function (see solvers.anytime)
+    '''
+    # warm start from a known facility set
+    if start is not None:
+        build.warm_start(model, start)
+    if anytime:
+        solvers.anytime(model, anytime if callable(anytime) else None)
+
     # solve the model
     logger.info('optimizing')
-    model.optimize()
+    begin = time.time()
+    if model.data.get('threads', 1) > 1:
+        model.solveConcurrent()
+    else:
+        model.optimize()
     logger.info('optimization complete')
+
     # identify which facilities are opened (i.e., their value = 1)
-    new_facilities = np.where([int(round(model.getVal(x[d]))) for d in destinations])[0]
-    return(new_facilities)
+    return(solvers.scip_result(model, build_time, time.time() - begin))
+
+
+def sweep(model, open_totals, build_time=None):
+    '''
+    solve one built model for several numbers of open facilities, only changing the right hand side
+    of its cardinality constraint in between. each solve is warm started from the previous optimum
+    extended greedily to the new number of facilities. yields each open_total with its result
+    as soon as it is solved, the first one carrying the build_time of the model
+    '''
+    data = model.data
+    previous = None
+    for open_total in sorted(open_totals):
+        if previous is not None:
+            # back to the original problem so the constraint can be changed
+            model.freeTransform()
+        cardinality = data['cardinality']
+        # keep lhs <= rhs while moving the equality
+        if open_total >= data['open_total']:
+            model.chgRhs(cardinality, open_total)
+            model.chgLhs(cardinality, open_total)
+        else:
+            model.chgLhs(cardinality, open_total)
+            model.chgRhs(cardinality, open_total)
+        data['open_total'] = open_total
+
+        start = None
+        if previous is not None:
+            x_previous = np.zeros(len(data['x']), dtype=bool)
+            x_previous[previous] = True
+            start = np.flatnonzero(heuristic.greedy(data['pairs'], data['populations'], x_previous, open_total))
+        logger.info('sweep: {} open facilities'.format(open_total))
+        result = solve(model, start, build_time=build_time if previous is None else None)
+        previous = result['open']
+        yield open_total, result
+
+
+def frontier(model, upper, lower=None, step=1e-5):
+    '''
+    efficient frontier of a set_kpcoef model: the fewest facilities for every kolm pollak budget from
+    upper down to lower (or until even opening everything is not enough). a solution with p
+    facilities and kolm pollak value v answers every budget in [v, budget], so the next budget tried
+    is just below v. ties between facility sets of the same size are broken towards the lowest
+    kolm pollak value, so every solve adds a breakpoint. yields the breakpoints as they are solved,
+    largest budget first. a solve that ends without proving optimality (e.g. at the time limit of a
+    profile) stops the curve: its budget is yielded with that status and no facilities
+    '''
+    data = model.data
+    # tie break: the kolm pollak term is worth less than one facility for any budget up to upper
+    tie_break = (data['budget_coef']/(2*upper)).tolist()
+    model.setObjective(quicksum(data['x']) + quicksum(c*y_od for c, y_od in zip(tie_break, data['y'])), 'minimize')
+
+    budget = upper
+    while lower is None or budget >= lower:
+        model.chgRhs(data['budget'], budget)
+        logger.info('frontier: kolm pollak budget {:.6g}'.format(budget))
+        model.optimize()
+        status = model.getStatus()
+        if status == 'infeasible':
+            break
+        if status != 'optimal':
+            # a non-optimal solution does not answer the budgets below it, so the curve ends here
+            logger.warning('frontier: stopped at budget {:.6g} with status {}'.format(budget, status))
+            yield {'budget': budget, 'kolmpollak': None, 'facilities': None, 'open': [], 'status': status}
+            break
+        facilities = build.open_facilities(model)
+        x = np.zeros(len(data['x']), dtype=bool)
+        x[facilities] = True
+        value = data['populations'] @ build.nearest_cost(data['pairs'], x)
+        logger.info('frontier: {} facilities for budgets in [{:.6g}, {:.6g}]'.format(len(facilities), value, budget))
+        yield {'budget': budget, 'kolmpollak': value, 'facilities': len(facilities), 'open': facilities,
+               'status': status}
+        # back to the original problem for the next budget, just below the one this solution reaches
+        model.freeTransform()
+        budget = value*(1 - step)
@@ -0,0 +1,102 @@
+'''
+Outer approximation of the nonlinear kolm pollak objective by lazily added tangents
+
+instead of w_o == populations[o]*e^(alpha*z_o) with z_o = sum_d distances[o,d]*y_o,d, the model only
+has linear tangents w_o >= populations[o]*e^(alpha*t)*(1 + alpha*(z_o - t)), which are valid for every
+t because e^(alpha*z) is convex. it starts with a few tangents per origin (see optimize.add_tangents),
+and a SCIP constraint handler adds the tangent at z_o wherever a solution's w_o falls below the curve
+by more than the tolerance. integer solutions are only accepted once every w_o is on the curve
+within the tolerance, so the optimum is the exact kolm pollak optimum within it
+'''
+
+# import libraries
+try:
+    from pyscipopt import Conshdlr, SCIP_RESULT, quicksum
+except ImportError:
+    # the outer approximation needs SCIP, this only lets main import without pyscipopt
+    Conshdlr = object
+import numpy as np
+import logging
+logging.basicConfig(
+    format='%(asctime)s %(levelname)-8s %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def add_tangent_cuts(model, od, populations, alpha, tolerance=1e-6):
+    '''
+    add the constraint handler generating tangents to a SCIP model with w and y in model.data
+    (see optimize.kolmpollak_model). tolerance is relative to populations[o]*e^(alpha*z_o)
+    '''
+    handler = TangentCuts(od, populations, alpha, model.data['w'], model.data['y'], tolerance)
+    model.includeConshdlr(handler, "tangentcuts", "outer approximation of the kolm pollak objective",
+                          sepapriority=1000, enfopriority=-1, chckpriority=-1, sepafreq=1, needscons=False)
+    # w is only bounded below through the lazy tangents, so presolve must not fix it at its bound
+    model.setBoolParam("misc/allowstrongdualreds", False)
+    model.setBoolParam("misc/allowweakdualreds", False)
+    model.data['tangents'] = handler
+    return handler
+
+
+class TangentCuts(Conshdlr):
+    '''
+    adds the tangent at z_o for every origin whose w_o is below populations[o]*e^(alpha*z_o)
+    '''
+
+    def __init__(self, od, populations, alpha, w, y, tolerance):
+        self.od, self.populations, self.alpha = od, populations, alpha
+        self.w, self.y = w, y
+        self.tolerance = tolerance
+        self.n_cuts = 0
+
+    def violated(self, solution=None):
+        '''
+        origins whose w is below the curve in the solution (the current LP/pseudo solution if None),
+        with their z
+        '''
+        y_value = np.array([self.model.getSolVal(solution, y_od) for y_od in self.y])
+        w_value = np.array([self.model.getSolVal(solution, w_o) for w_o in self.w])
+        z = np.bincount(self.od['rows'], weights=self.od['cost']*y_value, minlength=len(self.w))
+        curve = self.populations*np.exp(self.alpha*z)
+        origins = np.flatnonzero(w_value < curve - self.tolerance*np.maximum(1, curve))
+        return origins, z[origins]
+
+    def add_cuts(self, solution=None):
+        '''
+        add the tangents at the violated points, returns whether there were any
+        '''
+        origins, z = self.violated(solution)
+        indptr, cost = self.od['indptr'], self.od['cost']
+        for o, t in zip(origins.tolist(), z.tolist()):
+            # w_o - p*e^(alpha*t)*alpha*sum_d c*y_o,d >= p*e^(alpha*t)*(1 - alpha*t)
+            slope = self.populations[o]*np.exp(self.alpha*t)
+            begin, end = indptr[o], indptr[o + 1]
+            self.model.addCons(self.w[o] - quicksum(slope*self.alpha*c*y_od for c, y_od in
+                                                    zip(cost[begin:end].tolist(), self.y[begin:end]))
+                               >= slope*(1 - self.alpha*t), removable=True)
+        self.n_cuts += len(origins)
+        return len(origins) > 0
+
+    def conscheck(self, constraints, solution, checkintegrality, checklprows, printreason, completely, **kwargs):
+        if len(self.violated(solution)[0]) > 0:
+            return {"result": SCIP_RESULT.INFEASIBLE}
+        return {"result": SCIP_RESULT.FEASIBLE}
+
+    def consenfolp(self, constraints, nusefulconss, solinfeasible):
+        if self.add_cuts():
+            return {"result": SCIP_RESULT.CONSADDED}
+        return {"result": SCIP_RESULT.FEASIBLE}
+
+    def consenfops(self, constraints, nusefulconss, solinfeasible, objinfeasible):
+        if self.add_cuts():
+            return {"result": SCIP_RESULT.CONSADDED}
+        return {"result": SCIP_RESULT.FEASIBLE}
+
+    def conssepalp(self, constraints, nusefulconss):
+        if self.add_cuts():
+            return {"result": SCIP_RESULT.CONSADDED}
+        return {"result": SCIP_RESULT.DIDNOTFIND}
+
+    def conslock(self, constraint, locktype, nlockspos, nlocksneg):
+        pass
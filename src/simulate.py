@@ -0,0 +1,188 @@
+'''
+Monte Carlo simulation of store closures (e.g. after a disaster): every scenario closes each store
+independently with its closure probability, and the origins go to their nearest store still open
+
+    python src/simulate.py config/neworleans-set_kpcoef.yml --scenarios 10000 --probability 0.2 --processes 8
+
+the stores are the service destinations (all of them for the restore objective, the open ones for add).
+each origin's distances to the stores are sorted once, so an origin's nearest open store in a scenario
+is the first open one in its order; the scenarios are drawn and scored in batches (numpy, one batch per
+task) across a process pool. per scenario: the kolm pollak EDE, population weighted mean and max distance
+(see evaluate.scores), the number of stores closed and of origins left without one. per origin: mean,
+std and max of the distance to its nearest open store, the probability that it is further than with
+every store open and that no store is left. distances are in the units of the data (untransformed)
+'''
+
+# import libraries
+import os
+import sys
+import yaml
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+import evaluate
+import import_location
+import logging
+logging.basicConfig(
+    format='%(asctime)s %(levelname)-8s %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+# the arrays every task of the pool works on, set once per process by share
+shared = {}
+
+
+def share(sorted_cost, order, populations, probability, alpha):
+    shared.update(sorted_cost=sorted_cost, order=order, populations=populations, probability=probability, alpha=alpha)
+
+
+def stores_of(location, config):
+    '''
+    the service stores a scenario can close: every destination for the restore objective, the open
+    ones for add
+    '''
+    if config.get('objective') == 'restore':
+        return list(location['destinations'])
+    return list(location['existing'])
+
+
+def closure_probabilities(stores, probability):
+    '''
+    the closure probability of every store: probability is one for all of them, or a dict by store id
+    (stores not in it never close)
+    '''
+    if isinstance(probability, dict):
+        return np.array([probability.get(store, 0.0) for store in stores], dtype=float)
+    return np.full(len(stores), float(probability))
+
+
+def simulate(location, stores, probability, scenarios=1000, seed=None, processes=None, max_block=2**26):
+    '''
+    simulate scenarios closure scenarios of stores (destination ids) with probability (see
+    closure_probabilities). returns the scenarios, origins and summary tables (see summarize), with
+    the kolm pollak EDE if the location has an alpha
+    '''
+    distances = location['distances']
+    cols = np.array([location['destination_index'][store] for store in stores], dtype=int)
+    block = evaluate.columns(distances, cols)
+    # each origin's stores from nearest to furthest, np.inf appended for when all are closed
+    order = np.argsort(block, axis=1, kind='stable')
+    sorted_cost = np.column_stack([np.take_along_axis(block, order, axis=1), np.full(len(block), np.inf)])
+    populations = np.asarray(location['populations'], dtype=float)
+    probability = closure_probabilities(stores, probability)
+
+    # scenarios per task, keeping a task's open masks (scenarios x origins x stores) within max_block
+    batch = max(1, min(scenarios, max_block//max(1, block.size)))
+    sizes = [min(batch, scenarios - begin) for begin in range(0, scenarios, batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    processes = processes or multiprocessing.cpu_count()
+    logger.info('simulate: {} scenarios of {} stores in {} batches on {} processes'.format(
+        scenarios, len(stores), len(sizes), processes))
+    arguments = (sorted_cost, order, populations, probability, location.get('alpha'))
+    if processes > 1 and len(sizes) > 1:
+        with multiprocessing.Pool(processes, initializer=share, initargs=arguments) as pool:
+            parts = pool.map(simulate_batch, zip(seeds, sizes))
+    else:
+        share(*arguments)
+        parts = [simulate_batch(task) for task in zip(seeds, sizes)]
+    return summarize(location, parts, sorted_cost[:, 0], scenarios)
+
+
+def simulate_batch(task):
+    '''
+    draw and score size scenarios: the per scenario scores and the per origin sums the summary needs
+    '''
+    seed, size = task
+    sorted_cost, order = shared['sorted_cost'], shared['order']
+    rng = np.random.default_rng(seed)
+    is_open = rng.random((size, len(shared['probability']))) >= shared['probability']
+    # the first open store in each origin's order, the appended np.inf column if there is none
+    open_sorted = is_open[:, order]
+    first = np.where(open_sorted.any(axis=2), open_sorted.argmax(axis=2), order.shape[1])
+    nearest = sorted_cost[np.arange(len(sorted_cost))[None, :], first].T
+
+    # np.inf for the scenarios leaving an origin without a store, which the summary leaves out
+    with np.errstate(invalid='ignore', over='ignore'):
+        scores = evaluate.scores(nearest, shared['populations'], shared['alpha'])
+    scores['closed'] = (~is_open).sum(axis=1)
+    reached = np.isfinite(nearest)
+    scores['unreached'] = (~reached).sum(axis=0)
+    finite = np.where(reached, nearest, 0)
+    return {'scores': scores,
+            'sum': finite.sum(axis=1), 'squares': (finite**2).sum(axis=1), 'reached': reached.sum(axis=1),
+            'max': np.where(reached, nearest, -np.inf).max(axis=1),
+            'worse': (nearest > sorted_cost[:, :1]).sum(axis=1)}
+
+
+def summarize(location, parts, baseline, scenarios):
+    '''
+    the scenarios table (one row per scenario, with the number of origins left without a store), the
+    origins table (distribution of each origin's distance to its nearest open store, over the scenarios
+    where one is left) and the city wide summary: mean, std and quantiles of the scenario scores over the
+    scenarios where every origin still has a store (of closed and unreached over all of them), and the
+    share of scenarios leaving some origin without a store as the row p unreachable
+    '''
+    table = pd.DataFrame({name: np.concatenate([part['scores'][name] for part in parts])
+                          for name in parts[0]['scores']})
+    table.index.name = 'scenario'
+
+    total = {name: np.sum([part[name] for part in parts], axis=0) for name in ('sum', 'squares', 'reached', 'worse')}
+    reached = np.maximum(total['reached'], 1)
+    mean = total['sum']/reached
+    origins = pd.DataFrame({'population': location['populations'], 'all open': baseline, 'mean': mean,
+                            'std': np.sqrt(np.maximum(total['squares']/reached - mean**2, 0)),
+                            'max': np.max([part['max'] for part in parts], axis=0),
+                            'p worse': total['worse']/scenarios,
+                            'p unreached': 1 - total['reached']/scenarios}, index=location['origins'])
+    origins.loc[total['reached'] == 0, ['mean', 'std', 'max']] = np.nan
+    origins.index.name = 'origin'
+
+    quantiles = [0.05, 0.25, 0.5, 0.75, 0.95]
+    reachable = table['unreached'] == 0
+    distribution = pd.concat([table[reachable].drop(columns=['closed', 'unreached']),
+                              table[['closed', 'unreached']]], axis=1)
+    summary = distribution.agg(['mean', 'std', 'min', 'max'])
+    summary = pd.concat([summary, distribution.quantile(quantiles).rename(index=lambda q: 'q{:g}'.format(100*q))])
+    summary.loc['p unreachable'] = 1 - reachable.mean()
+    if not reachable.all():
+        logger.warning('simulate: {} of {} scenarios leave some origin without a store, left out of the score summary'.format(
+            (~reachable).sum(), len(table)))
+    return {'scenarios': table, 'origins': origins, 'summary': summary}
+
+
+def main(config, scenarios=1000, probability=None, seed=None, processes=None, output='simulation'):
+    '''
+    simulate the closures of the stores of a config (see stores_of), with config['closure_probability']
+    (one for all stores, or by store id) unless probability is given, writing output-scenarios.csv,
+    output-origins.csv and output-summary.csv
+    '''
+    location = import_location.main(config)
+    if 'alpha' not in location:
+        location['alpha'] = import_location.calculate_kappa(location, config)
+    probability = config.get('closure_probability', 0.1) if probability is None else probability
+    results = simulate(location, stores_of(location, config), probability, scenarios, seed, processes)
+    for name, table in results.items():
+        table.to_csv('{}-{}.csv'.format(output, name))
+    summary = results['summary']
+    logger.info('simulate: EDE {:.6g} on average, {:.6g} in the 95th percentile, {:.1%} of scenarios unreachable'.format(
+        summary.loc['mean', 'kolmpollak'], summary.loc['q95', 'kolmpollak'], summary.loc['p unreachable', 'kolmpollak']))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='simulate store closures')
+    parser.add_argument('config', help='config file, e.g. config/neworleans-set_kpcoef.yml')
+    parser.add_argument('--scenarios', type=int, default=1000, help='closure scenarios to draw')
+    parser.add_argument('--probability', type=float, default=None,
+                        help='closure probability of every store (default: closure_probability in the config)')
+    parser.add_argument('--seed', type=int, default=None, help='random seed')
+    parser.add_argument('--processes', type=int, default=None, help='parallel processes (default: one per core)')
+    parser.add_argument('--output', default='simulation', help='prefix of the output tables')
+    args = parser.parse_args()
+    if not os.path.exists(args.config):
+        sys.exit('no config {}'.format(args.config))
+    with open(args.config) as file:
+        config = yaml.safe_load(file)
+    main(config, args.scenarios, args.probability, args.seed, args.processes, args.output)
@@ -0,0 +1,245 @@
+'''
+Solver backends for the linear programs built in build.py and optimize.py
+- scip: a PySCIPOpt model with the same model.data as before (x, y, cardinality, ...),
+  which can still be extended with nonlinear constraints, warm started, swept or re-solved
+- highs: HiGHS through scipy.optimize.milp on the sparse constraint matrix, no pyscipopt needed
+both take a solver profile (time limit, gap, threads, emphasis, heuristics) from config/solver_profiles.yml
+
+every method reports a result dict (see result): the open facilities as positions and as destination
+ids, objective, bound, gap, nodes, status, build and solve times. with SCIP an anytime mode streams
+every improved incumbent to the log and a callback while it runs (see Incumbents)
+'''
+
+# import libraries
+from scipy.optimize import milp, Bounds, LinearConstraint
+from scipy import sparse
+try:
+    from pyscipopt import Model, Eventhdlr, Sepa, SCIP_EVENTTYPE, SCIP_PARAMEMPHASIS, SCIP_PARAMSETTING, SCIP_RESULT
+    from pyscipopt.scip import Expr, ExprCons
+except ImportError:
+    # only the highs backend runs without pyscipopt
+    Eventhdlr = Sepa = object
+import time
+import numpy as np
+import build
+import logging
+logging.basicConfig(
+    format='%(asctime)s %(levelname)-8s %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+# program entries holding column indices, row indices, and the matrix itself
+COLUMNS = ('x', 'y', 'w')
+ROWS = ('cardinality', 'budget')
+MATRIX = ('obj', 'lb', 'ub', 'integrality', 'rows', 'cols', 'vals', 'lower', 'upper', 'n_rows', 'offset')
+
+
+def scip_model(program):
+    '''
+    SCIP model of a program. model.data holds the program's variables and constraints as pyscipopt
+    objects (e.g. x, y and cardinality) and its other entries (pairs, open, populations, ...) as they are
+    '''
+    model = Model()
+    A, lower, upper = build.constraint_matrix(program)
+
+    logger.info('scip: {} variables, {} constraints'.format(A.shape[1], A.shape[0]))
+    variables = [model.addVar(vtype=("B" if u is not None and u <= 1 else "I") if integral else "C", lb=l, ub=u, obj=c)
+                 for c, l, u, integral in zip(program['obj'].tolist(), program['lb'].tolist(),
+                                              finite(program['ub']), program['integrality'].tolist())]
+    if program['offset'] != 0:
+        model.addObjoffset(program['offset'])
+
+    # every row is created empty and filled a coefficient at a time from the matrix: building an Expr
+    # per row costs more than the row itself on dense instances
+    constraints = [model.addCons(ExprCons(Expr(), lhs=lo, rhs=up)) for lo, up in zip(finite(lower), finite(upper))]
+    add = model.addCoefLinear
+    A = A.tocoo()
+    for i, j, a in zip(A.row.tolist(), A.col.tolist(), A.data.tolist()):
+        add(constraints[i], variables[j], a)
+
+    model.data = {key: value for key, value in program.items() if key not in MATRIX}
+    for key in COLUMNS:
+        if program.get(key) is not None:
+            model.data[key] = [variables[j] for j in program[key]]
+    for key in ROWS:
+        if program.get(key) is not None:
+            model.data[key] = constraints[program[key]]
+    if program.get('linking') is not None:
+        # lazy linking (see build.add_assignment): SCIP separates the strong rows
+        sepa = LinkingCuts([variables[j] for j in program['linking']['y'].tolist()],
+                           [model.data['x'][d] for d in program['linking']['x'].tolist()])
+        model.includeSepa(sepa, "linking", "violated y <= x linking rows", priority=1000, freq=1)
+        model.data['linking'] = sepa
+    return model
+
+
+def finite(bounds):
+    '''
+    the bounds as a list, None (no bound for pyscipopt) where infinite
+    '''
+    return [b if is_finite else None for b, is_finite in zip(bounds.tolist(), np.isfinite(bounds).tolist())]
+
+
+def apply_profile(model, profile=None):
+    '''
+    set a solver profile (see config/solver_profiles.yml) on a SCIP model: time_limit (seconds),
+    gap (relative), emphasis, heuristics, threads (a concurrent solve, see optimize.solve)
+    and any other SCIP parameters by name. export writes the model to that file (e.g. for the cache)
+    '''
+    if not profile:
+        return model
+    if profile.get('time_limit') is not None:
+        model.setRealParam('limits/time', profile['time_limit'])
+    if profile.get('gap') is not None:
+        model.setRealParam('limits/gap', profile['gap'])
+    # emphasis first, it resets the heuristics among others
+    if profile.get('emphasis') is not None:
+        model.setEmphasis(getattr(SCIP_PARAMEMPHASIS, profile['emphasis'].upper()))
+    if profile.get('heuristics') is not None:
+        # yaml reads an unquoted off as False
+        setting = 'off' if profile['heuristics'] is False else profile['heuristics']
+        model.setHeuristics(getattr(SCIP_PARAMSETTING, setting.upper()))
+    if profile.get('threads', 1) > 1:
+        model.setIntParam('parallel/maxnthreads', profile['threads'])
+        model.data['threads'] = profile['threads']
+    for name, value in profile.get('parameters', {}).items():
+        model.setParam(name, value)
+    if profile.get('export') is not None:
+        model.writeProblem(profile['export'])
+    logger.info('scip profile: {}'.format(profile))
+    return model
+
+
+def highs(program, start=None, profile=None, build_time=None):
+    '''
+    solve a program with HiGHS under a solver profile, returns the result.
+    scipy.optimize.milp only exposes the time limit and gap of a profile, and no incumbents
+    '''
+    if start is not None:
+        logger.info('highs: scipy.optimize.milp takes no starting solution, solving without it')
+    options = {}
+    if profile:
+        if profile.get('time_limit') is not None:
+            options['time_limit'] = profile['time_limit']
+        if profile.get('gap') is not None:
+            options['mip_rel_gap'] = profile['gap']
+        ignored = sorted(set(profile) - {'time_limit', 'gap'})
+        if ignored:
+            logger.info('highs: ignoring {} of the profile'.format(', '.join(ignored)))
+    A, lower, upper = build.constraint_matrix(program)
+    if program.get('linking') is not None:
+        # no separation callbacks through scipy, so every linking row goes in
+        logger.info('highs: adding the {} lazy linking rows up front'.format(len(program['linking']['y'])))
+        A = sparse.vstack([A, build.linking_matrix(program)], format='csr')
+        lower = np.concatenate([lower, np.full(len(program['linking']['y']), -np.inf)])
+        upper = np.concatenate([upper, np.zeros(len(program['linking']['y']))])
+    logger.info('optimizing with highs: {} variables, {} constraints'.format(A.shape[1], A.shape[0]))
+    begin = time.time()
+    solution = milp(program['obj'], integrality=program['integrality'], bounds=Bounds(program['lb'], program['ub']),
+                    constraints=LinearConstraint(A, lower, upper), options=options)
+    solve_time = time.time() - begin
+    logger.info('optimization complete: {}'.format(solution.message))
+
+    status = {0: 'optimal', 1: 'limit', 2: 'infeasible', 3: 'unbounded'}.get(solution.status, 'other')
+    if solution.x is None:
+        return(result(program['destinations'], [], status=status, build_time=build_time, solve_time=solve_time))
+    bound = solution.mip_dual_bound + program['offset'] if solution.get('mip_dual_bound') is not None else None
+    return(result(program['destinations'], np.flatnonzero(solution.x[program['x']] > 0.5),
+                  objective=solution.fun + program['offset'], bound=bound, nodes=solution.get('mip_node_count'),
+                  status=status, build_time=build_time, solve_time=solve_time))
+
+
+def scip_result(model, build_time=None, solve_time=None):
+    '''
+    result of a solved SCIP model, with the incumbents it streamed if in anytime mode
+    '''
+    has_solution = model.getNSols() > 0
+    solution = result(model.data['destinations'], build.open_facilities(model) if has_solution else [],
+                      objective=model.getObjVal() if has_solution else None, bound=model.getDualbound(),
+                      nodes=model.getNNodes(), status=model.getStatus(), build_time=build_time, solve_time=solve_time)
+    if model.data.get('incumbents') is not None:
+        solution['incumbents'] = model.data['incumbents']
+    return(solution)
+
+
+def result(destinations, open_positions, objective=None, bound=None, nodes=None, status=None,
+           build_time=None, solve_time=None):
+    '''
+    the result of any method: open (positions in destinations), facilities (their ids), objective,
+    bound, relative gap, nodes, status, build_time and solve_time (seconds). unknown entries are None
+    '''
+    open_positions = np.asarray(open_positions, dtype=int)
+    objective = float(objective) if objective is not None else None
+    bound = float(bound) if bound is not None else None
+    gap = None
+    if objective is not None and bound is not None:
+        gap = abs(objective - bound)/abs(objective) if objective != 0 else 0.0
+    return {'open': open_positions, 'facilities': [destinations[d] for d in open_positions],
+            'objective': objective, 'bound': bound, 'gap': gap, 'nodes': nodes, 'status': status,
+            'build_time': build_time, 'solve_time': solve_time}
+
+
+class LinkingCuts(Sepa):
+    '''
+    separator behind lazy linking: adds y_o,d <= x_d as a cut for every pair the LP solution violates
+    '''
+
+    def __init__(self, y, x, tolerance=1e-6):
+        self.y, self.x = y, x
+        self.tolerance = tolerance
+        self.n_cuts = 0
+
+    def sepaexeclp(self):
+        model = self.model
+        y_value = np.array([model.getSolVal(None, y_od) for y_od in self.y])
+        x_value = np.array([model.getSolVal(None, x_d) for x_d in self.x])
+        violated = np.flatnonzero(y_value - x_value > self.tolerance)
+        for k in violated.tolist():
+            row = model.createEmptyRowSepa(self, "link", lhs=None, rhs=0, removable=True)
+            model.addVarToRow(row, model.getTransformedVar(self.y[k]), 1)
+            model.addVarToRow(row, model.getTransformedVar(self.x[k]), -1)
+            model.addCut(row)
+            model.releaseRow(row)
+        self.n_cuts += len(violated)
+        return {"result": SCIP_RESULT.SEPARATED if len(violated) > 0 else SCIP_RESULT.DIDNOTFIND}
+
+
+def anytime(model, callback=None):
+    '''
+    stream every improved incumbent of a SCIP model while it solves: logged, kept in
+    model.data['incumbents'] and passed to callback (if given) as a dict of time, objective,
+    bound, gap, open and facilities
+    '''
+    model.data['incumbents'] = []
+    model.includeEventhdlr(Incumbents(callback), "incumbents", "streams improved incumbents")
+    return model
+
+
+class Incumbents(Eventhdlr):
+    '''
+    event handler behind anytime
+    '''
+
+    def __init__(self, callback=None):
+        self.callback = callback
+
+    def eventinit(self):
+        self.model.catchEvent(SCIP_EVENTTYPE.BESTSOLFOUND, self)
+
+    def eventexit(self):
+        self.model.dropEvent(SCIP_EVENTTYPE.BESTSOLFOUND, self)
+
+    def eventexec(self, event):
+        model = self.model
+        sol = model.getBestSol()
+        x_value = np.array([model.getSolVal(sol, x_d) for x_d in model.data['x']])
+        incumbent = result(model.data['destinations'], np.flatnonzero(x_value > 0.5),
+                           objective=model.getSolObjVal(sol), bound=model.getDualbound())
+        incumbent = {'time': model.getSolvingTime(), 'objective': incumbent['objective'], 'bound': incumbent['bound'],
+                     'gap': incumbent['gap'], 'open': incumbent['open'], 'facilities': incumbent['facilities']}
+        logger.info('incumbent at {:.1f}s: objective {:.6g}, bound {:.6g}, gap {:.2%}'.format(
+            incumbent['time'], incumbent['objective'], incumbent['bound'], incumbent['gap']))
+        model.data['incumbents'].append(incumbent)
+        if self.callback is not None:
+            self.callback(incumbent)